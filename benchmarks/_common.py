@@ -0,0 +1,139 @@
+'''
+Shared helpers for the benchmark scripts: timing, result records, and the JSON output format.
+
+A results file is a JSON object with the keys "format", "version", "suite", "created",
+"environment", "parameters", and "results".
+Each result has a unique "name" and its timings in seconds so that compare.py can match the
+results of two runs by name.
+'''
+
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+
+FORMAT_VERSION = 1
+
+_REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_repository_to_path():
+    'Makes fuse, fusell, and the examples importable without installing them.'
+    for path in (_REPOSITORY, os.path.join(_REPOSITORY, 'examples')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def measure(function, min_time=0.2, repeat=5, max_iterations=1 << 20):
+    '''
+    Calls function in a loop until at least min_time seconds have passed, like timeit.autorange,
+    and repeats that with the found iteration count. Returns the iteration count and the list of
+    seconds per call for each repetition.
+    '''
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or iterations >= max_iterations:
+            break
+        iterations = min(max_iterations, iterations * 10 if elapsed < min_time / 10 else iterations * 2)
+
+    timings = [elapsed / iterations]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        timings.append((time.perf_counter() - start) / iterations)
+    return iterations, timings
+
+
+def make_result(name, iterations, timings, bytes_per_call=None, items_per_call=None, **extra):
+    '''
+    Returns a result record. The minimum over the repetitions is the most reproducible estimate
+    and the one used by compare.py; the median and maximum show how noisy the machine was.
+    '''
+    best = min(timings)
+    result = {
+        'name': name,
+        'iterations': iterations,
+        'repeat': len(timings),
+        'seconds_min': best,
+        'seconds_median': statistics.median(timings),
+        'seconds_max': max(timings),
+        'calls_per_second': 1 / best if best > 0 else None,
+    }
+    if bytes_per_call:
+        result['bytes_per_call'] = bytes_per_call
+        result['bytes_per_second'] = bytes_per_call / best if best > 0 else None
+    if items_per_call:
+        result['items_per_call'] = items_per_call
+        result['items_per_second'] = items_per_call / best if best > 0 else None
+    result.update(extra)
+    return result
+
+
+def skipped(name, reason):
+    return {'name': name, 'skipped': reason}
+
+
+def environment():
+    add_repository_to_path()
+    info = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+    try:
+        import fuse
+        info['fuse_version'] = f"{fuse.fuse_version_major}.{fuse.fuse_version_minor}"
+    except (ImportError, OSError) as exception:
+        info['fuse_version'] = None
+        info['fuse_error'] = str(exception)
+    return info
+
+
+def select(names, pattern):
+    'Returns the names matching the regular expression pattern, or all of them if it is None.'
+    if not pattern:
+        return list(names)
+    regex = re.compile(pattern)
+    return [name for name in names if regex.search(name)]
+
+
+def print_result(result):
+    'Prints a human-readable summary to stderr, which keeps stdout free for the JSON output.'
+    if 'skipped' in result:
+        print(f"{result['name']:<40} skipped: {result['skipped']}", file=sys.stderr, flush=True)
+        return
+    line = f"{result['name']:<40} {result['seconds_min'] * 1e6:12.2f} us/call"
+    if 'bytes_per_second' in result:
+        line += f" {result['bytes_per_second'] / 2**20:10.1f} MiB/s"
+    if 'items_per_second' in result:
+        line += f" {result['items_per_second']:12.0f} items/s"
+    print(line, file=sys.stderr, flush=True)
+
+
+def write_results(path, suite, results, parameters=None):
+    document = {
+        'format': 'fusepy-benchmark',
+        'version': FORMAT_VERSION,
+        'suite': suite,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'parameters': parameters or {},
+        'results': results,
+    }
+    if path == '-':
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(document, file, indent=2)
+        file.write('\n')
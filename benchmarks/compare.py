@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+'''
+Compares two result files of micro.py or mounted.py by benchmark name and prints the speedup,
+which is the old divided by the new minimum time. Benchmarks that only exist in one of the
+files or were skipped are ignored.
+
+Usage: python3 benchmarks/compare.py old.json new.json [--threshold 0.1]
+
+The exit code is 1 if any benchmark is slower by more than the threshold, which makes this
+usable as a regression check.
+'''
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding='utf-8') as file:
+        document = json.load(file)
+    if document.get('format') != 'fusepy-benchmark':
+        raise ValueError(f"{path} is not a fusepy benchmark result file.")
+    return {result['name']: result for result in document['results'] if 'skipped' not in result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown above which a benchmark counts as regressed. Default: %(default)s')
+    args = parser.parse_args()
+
+    old, new = load(args.old), load(args.new)
+    regressions = []
+    for name in (name for name in new if name in old):
+        before, after = old[name]['seconds_min'], new[name]['seconds_min']
+        speedup = before / after if after > 0 else float('inf')
+        marker = ''
+        if after > before * (1 + args.threshold):
+            marker = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<40} {before * 1e6:12.2f} us -> {after * 1e6:12.2f} us  {speedup:6.2f}x{marker}")
+
+    if regressions:
+        print(f"{len(regressions)} of the compared benchmarks regressed by more than {args.threshold:.0%}.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+'''
+Microbenchmarks for the per-callback overhead of the high-level (fuse.py) and the low-level
+(fusell.py) bindings. Nothing is mounted: the ctypes callbacks are called directly in-process,
+so the measured time covers the ctypes trampoline, the argument and result conversions of the
+bindings, and a trivial in-memory implementation of the operation.
+
+High-level callbacks are set up with fuse.FuseHarness. For the low-level bindings, FUSELL is
+created without its constructor, which would mount, and the fuse_reply_* functions are
+replaced because they require a real request from the kernel. The replacement for
+fuse_reply_buf copies the data like libfuse does so that reads compare with the high-level
+ones, which copy into the buffer given by libfuse.
+
+Usage: python3 benchmarks/micro.py --output micro.json [--filter REGEX] [--quick]
+'''
+
+import argparse
+import ctypes
+import sys
+import warnings
+
+from _common import (add_repository_to_path, make_result, measure, print_result, select,
+                     skipped, write_results)
+
+add_repository_to_path()
+
+import fuse  # noqa: E402
+
+READ_SIZES = (4 << 10, 128 << 10, 1 << 20)
+WRITE_SIZES = (4 << 10, 128 << 10, 1 << 20)
+DIRECTORY_SIZES = (10, 10_000, 1_000_000)
+
+FILE_ATTRIBUTES = {'st_mode': 0o100644, 'st_nlink': 1, 'st_size': 1 << 20}
+
+
+def _directory_names(count):
+    return [f"file{i:07d}" for i in range(count)]
+
+
+class BenchmarkOperations(fuse.Operations):
+    'A read-only, in-memory file system with one file and one directory per directory size.'
+
+    use_ns = True
+
+    def __init__(self, directory_sizes):
+        self.data = bytes(max(READ_SIZES))
+        self.listings = {f"/dir{count}": _directory_names(count) for count in directory_sizes}
+
+    def getattr(self, path, fh=None):
+        return FILE_ATTRIBUTES
+
+    def read(self, path, size, offset, fh):
+        return self.data[offset:offset + size]
+
+    def write(self, path, data, offset, fh):
+        return len(data)
+
+    def readdir(self, path, fh):
+        return self.listings[path]
+
+
+def high_level_benchmarks(directory_sizes):
+    harness = fuse.FuseHarness(BenchmarkOperations(directory_sizes))
+    fip = harness.file_info(fh=1)
+    stat = fuse.c_stat()
+    extra = () if fuse.fuse_version_major == 2 else (fip,)
+
+    benchmarks = {'highlevel.getattr': (lambda: harness.call('getattr', b'/file', ctypes.byref(stat), *extra), {})}
+
+    for size in READ_SIZES:
+        buffer = ctypes.cast(ctypes.create_string_buffer(size), ctypes.POINTER(ctypes.c_byte))
+        benchmarks[f"highlevel.read.{size // 1024}k"] = (
+            lambda buffer=buffer, size=size: harness.call('read', b'/file', buffer, size, 0, fip),
+            {'bytes_per_call': size})
+
+    for size in WRITE_SIZES:
+        buffer = ctypes.cast(ctypes.create_string_buffer(size), ctypes.POINTER(ctypes.c_byte))
+        benchmarks[f"highlevel.write.{size // 1024}k"] = (
+            lambda buffer=buffer, size=size: harness.call('write', b'/file', buffer, size, 0, fip),
+            {'bytes_per_call': size})
+
+    filler = harness.new_filler()
+    flags = () if fuse.fuse_version_major == 2 else (0,)
+    for count in directory_sizes:
+        path = f"/dir{count}".encode()
+        benchmarks[f"highlevel.readdir.{count}"] = (
+            lambda path=path: harness.call('readdir', path, None, filler, 0, fip, *flags),
+            {'items_per_call': count})
+
+    return harness, benchmarks
+
+
+class _NullReplies:
+    '''
+    Stands in for fusell.LibFUSE. The replies are accepted and dropped, except for the data of
+    fuse_reply_buf, which is copied into a preallocated buffer. fuse_add_direntry only returns
+    the entry size like libfuse does, i.e., the aligned size of struct fuse_dirent with the name,
+    without writing anything.
+    '''
+
+    def __init__(self, buffer_size):
+        self._buffer = ctypes.create_string_buffer(buffer_size)
+
+    def fuse_reply_err(self, req, err):
+        return 0
+
+    def fuse_reply_attr(self, req, attr, attr_timeout):
+        return 0
+
+    def fuse_reply_buf(self, req, buf, size):
+        if size > len(self._buffer):
+            self._buffer = ctypes.create_string_buffer(size)
+        if buf is not None:
+            ctypes.memmove(self._buffer, buf, size)
+        return 0
+
+    def fuse_reply_write(self, req, count):
+        return 0
+
+    def fuse_add_direntry(self, req, buf, bufsize, name, stbuf, off):
+        return (24 + len(name) + 7) & ~7
+
+
+def low_level_benchmarks(directory_sizes):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import fusell
+
+    class BenchmarkLowLevel(fusell.FUSELL):
+        def getattr(self, req, ino, fi):
+            self.reply_attr(req, dict(FILE_ATTRIBUTES), 1.0)
+
+        def read(self, req, ino, size, off, fi):
+            self.reply_buf(req, self.data[off:off + size])
+
+        def write(self, req, ino, buf, off, fi):
+            self.reply_write(req, len(buf))
+
+        def readdir(self, req, ino, size, off, fi):
+            self.reply_readdir(req, size, off, self.listings[ino])
+
+    filesystem = object.__new__(BenchmarkLowLevel)
+    filesystem.libfuse = _NullReplies(max(READ_SIZES))
+    filesystem.encoding = 'utf-8'
+    filesystem.data = bytes(max(READ_SIZES))
+    directory_attributes = {'st_mode': 0o100644, 'st_ino': 2}
+    filesystem.listings = {
+        count: [(name, directory_attributes) for name in _directory_names(count)] for count in directory_sizes}
+
+    callbacks = {}
+    for name, prototype in fusell.fuse_lowlevel_ops._fields_:
+        if name in ('getattr', 'read', 'write', 'readdir'):
+            callbacks[name] = prototype(getattr(filesystem, 'fuse_' + name))
+    fi = ctypes.pointer(fusell.fuse_file_info(fh=1))
+
+    benchmarks = {'lowlevel.getattr': (lambda: callbacks['getattr'](None, 2, fi), {})}
+
+    for size in READ_SIZES:
+        benchmarks[f"lowlevel.read.{size // 1024}k"] = (
+            lambda size=size: callbacks['read'](None, 2, size, 0, fi), {'bytes_per_call': size})
+
+    for size in WRITE_SIZES:
+        buffer = ctypes.cast(ctypes.create_string_buffer(size), fusell.c_bytes_p)
+        benchmarks[f"lowlevel.write.{size // 1024}k"] = (
+            lambda buffer=buffer, size=size: callbacks['write'](None, 2, buffer, size, 0, fi),
+            {'bytes_per_call': size})
+
+    # Request the whole listing at once like the high-level readdir does, although the kernel
+    # asks for at most a few pages per call, for which reply_readdir still converts all entries.
+    for count in directory_sizes:
+        benchmarks[f"lowlevel.readdir.{count}"] = (
+            lambda count=count: callbacks['readdir'](None, count, 1 << 62, 0, fi), {'items_per_call': count})
+
+    return benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON file to write the results to. Default: stdout')
+    parser.add_argument('-f', '--filter', help='Only run benchmarks whose name matches this regular expression.')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Minimum duration in seconds of one repetition. Default: %(default)s')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions. Default: %(default)s')
+    parser.add_argument('--quick', action='store_true',
+                        help='Skip the 1M-entry directory and use a single short repetition.')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.min_time, args.repeat = 0.05, 1
+    directory_sizes = tuple(size for size in DIRECTORY_SIZES if not args.quick or size < 1_000_000)
+
+    results = []
+    harness, benchmarks = high_level_benchmarks(directory_sizes)
+    try:
+        benchmarks.update(low_level_benchmarks(directory_sizes))
+    except (ImportError, OSError) as exception:
+        # fusell only supports libfuse 2 and loads it on import.
+        for name in select(('lowlevel.getattr', 'lowlevel.read', 'lowlevel.write', 'lowlevel.readdir'),
+                           args.filter):
+            results.append(skipped(name, str(exception)))
+            print_result(results[-1])
+
+    with harness:
+        for name in select(benchmarks, args.filter):
+            function, counts = benchmarks[name]
+            iterations, timings = measure(function, min_time=args.min_time, repeat=args.repeat)
+            results.append(make_result(name, iterations, timings, **counts))
+            print_result(results[-1])
+
+    write_results(args.output, 'micro', results, {
+        'min_time': args.min_time,
+        'repeat': args.repeat,
+        'directory_sizes': directory_sizes,
+    })
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+'''
+End-to-end benchmarks against the mounted example file systems, examples/memory.py and
+examples/loopback.py. Each file system is served by a child process, without debug logging,
+and exercised through the kernel with ordinary system calls:
+
+ - metadata: create, stat, list, and unlink many empty files in the root directory
+ - sequential: write a file in large chunks and read it back
+ - random: read small blocks at random offsets
+ - parallel: several client threads doing random reads and stats concurrently
+
+This needs /dev/fuse and permission to mount, e.g., fusermount. If mounting is not possible,
+the results are recorded as skipped.
+
+Usage: python3 benchmarks/mounted.py --output mounted.json [--filesystem memory] [--quick]
+'''
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from _common import add_repository_to_path, make_result, print_result, select, skipped, write_results
+
+FILESYSTEMS = ('memory', 'loopback')
+SCENARIOS = ('metadata', 'sequential', 'random', 'parallel')
+
+MOUNT_TIMEOUT = 10
+
+
+def serve(filesystem, mountpoint, root):
+    'Runs in the child process and blocks until the file system is unmounted.'
+    add_repository_to_path()
+    from fuse import FUSE
+
+    if filesystem == 'memory':
+        from memory import Memory
+        operations = Memory()
+    else:
+        from loopback import Loopback
+        operations = Loopback(root)
+    FUSE(operations, mountpoint, foreground=True)
+
+
+class MountedFilesystem:
+    'Context manager that mounts one of the example file systems in a temporary directory.'
+
+    def __init__(self, filesystem):
+        self.filesystem = filesystem
+        self.directory = tempfile.mkdtemp(prefix='fusepy-benchmark-')
+        self.mountpoint = os.path.join(self.directory, 'mount')
+        self.root = os.path.join(self.directory, 'root')
+        os.mkdir(self.mountpoint)
+        os.mkdir(self.root)
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', self.filesystem, self.mountpoint, self.root],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + MOUNT_TIMEOUT
+        while not os.path.ismount(self.mountpoint):
+            if self.process.poll() is not None:
+                error = self.process.stderr.read().decode(errors='replace').strip()
+                self._cleanup()
+                raise RuntimeError(f"Mounting {self.filesystem} failed: {(error.splitlines() or ['?'])[-1]}")
+            if time.monotonic() > deadline:
+                self._unmount()
+                raise RuntimeError(f"Mounting {self.filesystem} timed out after {MOUNT_TIMEOUT} s.")
+            time.sleep(0.01)
+        return self.mountpoint
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._unmount()
+
+    def _unmount(self):
+        for command in (['fusermount3', '-u'], ['fusermount', '-u'], ['umount']):
+            if not os.path.ismount(self.mountpoint) or not shutil.which(command[0]):
+                continue
+            subprocess.run(command + [self.mountpoint], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self.process.wait(timeout=MOUNT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._cleanup()
+
+    def _cleanup(self):
+        self.process.stderr.close()
+        if not os.path.ismount(self.mountpoint):
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def metadata_scenario(prefix, mountpoint, args):
+    # The memory example only supports files in the root directory.
+    paths = [os.path.join(mountpoint, f"file{i:06d}") for i in range(args.files)]
+
+    def create():
+        for path in paths:
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+
+    def stat():
+        for path in paths:
+            os.stat(path)
+
+    def listdir():
+        os.listdir(mountpoint)
+
+    def unlink():
+        for path in paths:
+            os.unlink(path)
+
+    timings = {name: [] for name in ('create', 'stat', 'listdir', 'unlink')}
+    for _ in range(args.repeat):
+        for name, function in (('create', create), ('stat', stat), ('listdir', listdir), ('unlink', unlink)):
+            timings[name].extend(_timed(function, 1))
+    return [make_result(f"{prefix}.metadata.{name}", 1, values, items_per_call=args.files)
+            for name, values in timings.items()]
+
+
+def _write_file(path, size, chunk_size):
+    chunk = os.urandom(chunk_size)
+    with open(path, 'wb', buffering=0) as file:
+        for offset in range(0, size, chunk_size):
+            file.write(chunk[:size - offset])
+
+
+def sequential_scenario(prefix, mountpoint, args):
+    path = os.path.join(mountpoint, 'sequential')
+    size, chunk_size = args.file_size, args.chunk_size
+
+    def read():
+        with open(path, 'rb', buffering=0) as file:
+            while file.read(chunk_size):
+                pass
+
+    results = [make_result(f"{prefix}.sequential.write", 1,
+                           _timed(lambda: _write_file(path, size, chunk_size), args.repeat),
+                           bytes_per_call=size, chunk_size=chunk_size),
+               make_result(f"{prefix}.sequential.read", 1, _timed(read, args.repeat),
+                           bytes_per_call=size, chunk_size=chunk_size)]
+    os.unlink(path)
+    return results
+
+
+def _random_reads(path, size, block_size, count, seed):
+    generator = random.Random(seed)
+    blocks = size // block_size
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for _ in range(count):
+            os.pread(fd, block_size, generator.randrange(blocks) * block_size)
+    finally:
+        os.close(fd)
+
+
+def random_scenario(prefix, mountpoint, args):
+    path = os.path.join(mountpoint, 'random')
+    _write_file(path, args.file_size, args.chunk_size)
+    timings = _timed(lambda: _random_reads(path, args.file_size, args.block_size, args.reads, 0), args.repeat)
+    os.unlink(path)
+    return [make_result(f"{prefix}.random.read", 1, timings, bytes_per_call=args.reads * args.block_size,
+                        items_per_call=args.reads, block_size=args.block_size)]
+
+
+def parallel_scenario(prefix, mountpoint, args):
+    '''
+    Every client thread does the given number of random reads and stats. The system calls release
+    the GIL, so the clients do run concurrently and contend for the file system process.
+    '''
+    path = os.path.join(mountpoint, 'parallel')
+    _write_file(path, args.file_size, args.chunk_size)
+
+    def client(seed):
+        _random_reads(path, args.file_size, args.block_size, args.reads, seed)
+        for _ in range(args.reads):
+            os.stat(path)
+
+    def run():
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    timings = _timed(run, args.repeat)
+    os.unlink(path)
+    return [make_result(f"{prefix}.parallel.{args.clients}", 1, timings,
+                        bytes_per_call=args.clients * args.reads * args.block_size,
+                        items_per_call=2 * args.clients * args.reads, clients=args.clients)]
+
+
+_SCENARIO_FUNCTIONS = {
+    'metadata': metadata_scenario,
+    'sequential': sequential_scenario,
+    'random': random_scenario,
+    'parallel': parallel_scenario,
+}
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--serve':
+        serve(*sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON file to write the results to. Default: stdout')
+    parser.add_argument('--filesystem', choices=FILESYSTEMS, action='append',
+                        help='File system to benchmark. Can be given multiple times. Default: all')
+    parser.add_argument('-f', '--filter', help='Only run scenarios whose name, e.g., memory.random, matches this '
+                                               'regular expression.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions. Default: %(default)s')
+    parser.add_argument('--files', type=int, default=10_000,
+                        help='Number of files for the metadata scenario. Default: %(default)s')
+    parser.add_argument('--file-size', type=int, default=16 << 20,
+                        help='File size in bytes for the I/O scenarios. Default: %(default)s')
+    parser.add_argument('--chunk-size', type=int, default=128 << 10,
+                        help='Size of the sequential reads and writes. Default: %(default)s')
+    parser.add_argument('--block-size', type=int, default=4 << 10,
+                        help='Size of the random reads. Default: %(default)s')
+    parser.add_argument('--reads', type=int, default=5_000,
+                        help='Number of random reads per run and client. Default: %(default)s')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Number of client threads for the parallel scenario. Default: %(default)s')
+    parser.add_argument('--quick', action='store_true', help='Use small sizes and a single repetition.')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat, args.files, args.file_size, args.reads = 1, 500, 1 << 20, 500
+
+    results = []
+    for filesystem in args.filesystem or FILESYSTEMS:
+        scenarios = select((f"{filesystem}.{scenario}" for scenario in SCENARIOS), args.filter)
+        if not scenarios:
+            continue
+        if not os.path.exists('/dev/fuse'):
+            results.extend(skipped(name, '/dev/fuse does not exist') for name in scenarios)
+            for result in results[-len(scenarios):]:
+                print_result(result)
+            continue
+        try:
+            with MountedFilesystem(filesystem) as mountpoint:
+                for name in scenarios:
+                    scenario_results = _SCENARIO_FUNCTIONS[name.split('.')[1]](filesystem, mountpoint, args)
+                    for result in scenario_results:
+                        print_result(result)
+                    results.extend(scenario_results)
+        except (OSError, RuntimeError) as exception:
+            done = {result['name'].rsplit('.', 1)[0] for result in results}
+            for name in scenarios:
+                if name not in done:
+                    results.append(skipped(name, str(exception)))
+                    print_result(results[-1])
+
+    write_results(args.output, 'mounted', results, {
+        key: value for key, value in vars(args).items() if key not in ('output', 'filter', 'quick')})
+
+
+if __name__ == '__main__':
+    sys.exit(main())
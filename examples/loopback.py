@@ -26,6 +26,10 @@ class Loopback(LoggingMixIn, Operations):
     chmod = os.chmod
     chown = os.chown
 
+    if hasattr(os, 'copy_file_range'):
+        def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+            return os.copy_file_range(fh_in, fh_out, size, off_in, off_out)
+
     def create(self, path, mode):
         return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
 
@@ -50,6 +54,11 @@ class Loopback(LoggingMixIn, Operations):
         return os.link(self.root + source, target)
 
     listxattr = None
+
+    def lseek(self, path, offset, whence, fh):
+        with self.rwlock:
+            return os.lseek(fh, offset, whence)
+
     mkdir = os.mkdir
     mknod = os.mknod
     open = os.open
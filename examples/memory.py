@@ -132,7 +132,7 @@ class Memory(LoggingMixIn, Operations):
         self.files[path]['st_size'] = length
 
     def unlink(self, path):
-        self.data.pop(path)
+        self.data.pop(path, None)
         self.files.pop(path)
 
     def utimens(self, path, times=None):
@@ -24,12 +24,20 @@
 
 from __future__ import print_function, absolute_import, division
 
+import codecs
 import ctypes
 import errno
+import itertools
 import logging
 import os
+import posixpath
+import struct
+import threading
+import time
 import warnings
 
+from binascii import crc32
+from collections import OrderedDict, namedtuple
 from ctypes import (
     CFUNCTYPE,
     POINTER,
@@ -42,8 +50,7 @@ from ctypes import (
     c_uint64,
     c_void_p,
 )
-from ctypes.util import find_library
-from platform import machine, system
+from operator import methodcaller
 from signal import signal, SIGINT, SIG_DFL, SIGTERM
 from stat import S_IFDIR
 
@@ -64,8 +71,14 @@ except ImportError:
         return newfunc
 
 log = logging.getLogger("fuse")
-_system = system()
-_machine = machine()
+if hasattr(os, 'uname'):
+    # Same as platform.system() and platform.machine() without importing platform.
+    _uname = os.uname()
+    _system, _machine = _uname.sysname, _uname.machine
+else:
+    from platform import machine, system
+    _system = system()
+    _machine = machine()
 
 if _system == 'Windows' or _system.startswith('CYGWIN'):
     # NOTE:
@@ -110,9 +123,87 @@ class c_utimbuf(ctypes.Structure):
 #         ^^^^^^^^^^^^^^^^^^^^^^^^^^
 #     UnicodeDecodeError: 'utf-8' codec can't decode byte 0xe8 in position 1:
 #     invalid continuation byte
+# Tried before ctypes.util.find_library, which is slow because it spawns ldconfig or gcc on Linux.
+_LIBFUSE_SONAMES = ('libfuse.so.2', 'libfuse3.so.3')
+
+
+def _library_cache_path():
+    '''
+    Returns the path of the file caching the find_library result, or None if caching has been
+    disabled by setting FUSE_LIBRARY_CACHE to 0. Other values of it are used as the path.
+    '''
+    path = os.environ.get('FUSE_LIBRARY_CACHE')
+    if path == '0':
+        return None
+    if path:
+        return path
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'fusepy', 'libfuse-path')
+
+
+def _library_cache_key():
+    '''
+    Returns a hash over everything that may change the result of find_library. The ld.so cache
+    is rewritten by ldconfig whenever libraries get installed or removed.
+    '''
+    try:
+        ldconfig_mtime = os.stat('/etc/ld.so.cache').st_mtime_ns
+    except OSError:
+        ldconfig_mtime = 0
+    key = '\0'.join((_system, _machine, str(ctypes.sizeof(c_void_p)), str(ldconfig_mtime),
+                     os.environ.get('LD_LIBRARY_PATH', ''), os.environ.get('LIBRARY_PATH', '')))
+    return f"{crc32(key.encode()):08x}"
+
+
+def _find_libfuse():
+    '''
+    Returns the name or path of libfuse 2, or else libfuse 3, for ctypes.CDLL, or None if neither
+    can be found. The well-known sonames are tried first. The result of the find_library fallback
+    is cached on disk so that later imports in the same environment stay fast. Failing to write
+    the cache, e.g., because of a read-only home directory, is ignored.
+    '''
+    for soname in _LIBFUSE_SONAMES:
+        try:
+            ctypes.CDLL(soname)
+            return soname
+        except OSError:
+            pass
+
+    cache_path = _library_cache_path()
+    key = _library_cache_key() if cache_path else None
+    if cache_path:
+        try:
+            with open(cache_path, encoding='utf-8') as file:
+                cached_key, path = file.read().split('\n')[:2]
+            if cached_key == key:
+                ctypes.CDLL(path)
+                return path
+        except (OSError, ValueError):
+            pass
+
+    from ctypes.util import find_library
+
+    path = find_library('fuse') or find_library('fuse3')
+    if path and cache_path:
+        temporary_path = f"{cache_path}.{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                file.write(f"{key}\n{path}\n")
+            os.replace(temporary_path, cache_path)
+        except OSError:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+    return path
+
+
 _libfuse_path = os.environ.get('FUSE_LIBRARY_PATH')
 if not _libfuse_path:
     if _system == 'Darwin':
+        from ctypes.util import find_library
+
         # libfuse dependency
         _libiconv = ctypes.CDLL(find_library('iconv'), ctypes.RTLD_GLOBAL)
 
@@ -140,9 +231,7 @@ if not _libfuse_path:
             _libfuse_path += r"bin\winfsp-%s.dll" % ("x64" if sys.maxsize > 0xffffffff else "x86")
         # pytype: enable=module-attr
     else:
-        _libfuse_path = find_library('fuse')
-        if not _libfuse_path:
-            _libfuse_path = find_library('fuse3')
+        _libfuse_path = _find_libfuse()
 
 if not _libfuse_path:
     raise EnvironmentError('Unable to find libfuse')
@@ -652,11 +741,20 @@ class fuse_context(ctypes.Structure):
 _libfuse.fuse_get_context.restype = ctypes.POINTER(fuse_context)
 
 
-# FUSE_BUF_IS_FD    = (1 << 1),
-# FUSE_BUF_FD_SEEK  = (1 << 2),
-# FUSE_BUF_FD_RETRY = (1 << 3),
+FUSE_READDIR_PLUS = 1 << 0     # enum fuse_readdir_flags, FUSE 3 only
+FUSE_FILL_DIR_PLUS = 1 << 1    # enum fuse_fill_dir_flags, FUSE 3 only
+
+FUSE_BUF_IS_FD = 1 << 1
+FUSE_BUF_FD_SEEK = 1 << 2
+FUSE_BUF_FD_RETRY = 1 << 3
 fuse_buf_flags = ctypes.c_int
 
+FUSE_BUF_NO_SPLICE = 1 << 1
+FUSE_BUF_FORCE_SPLICE = 1 << 2
+FUSE_BUF_SPLICE_MOVE = 1 << 3
+FUSE_BUF_SPLICE_NONBLOCK = 1 << 4
+fuse_buf_copy_flags = ctypes.c_int
+
 class fuse_buf(ctypes.Structure):
     _fields_ = [
         ('size', ctypes.c_size_t),
@@ -666,14 +764,22 @@ class fuse_buf(ctypes.Structure):
         ('pos', c_off_t),
     ]
 
+# The buf member is a variable-length array, which is declared with one element in C.
+# Use _fuse_bufvec_buffers to access all 'count' elements.
 class fuse_bufvec(ctypes.Structure):
     _fields_ = [
         ('count', ctypes.c_size_t),
         ('idx', ctypes.c_size_t),
         ('off', ctypes.c_size_t),
-        ('buf', ctypes.POINTER(fuse_buf)),
+        ('buf', fuse_buf * 1),
     ]
 
+# Added in 2.9 together with read_buf and write_buf.
+if hasattr(_libfuse, 'fuse_buf_copy'):
+    _libfuse.fuse_buf_copy.argtypes = (
+        ctypes.POINTER(fuse_bufvec), ctypes.POINTER(fuse_bufvec), fuse_buf_copy_flags)
+    _libfuse.fuse_buf_copy.restype = ctypes.c_ssize_t
+
 
 if fuse_version_major == 2:
     class fuse_conn_info(ctypes.Structure):  # Added in 2.6 (ABI break of "init" from 2.5->2.6)
@@ -706,6 +812,70 @@ elif fuse_version_major == 3:
         ]
 
 
+# Capability flags for fuse_conn_info.capable and want. The values differ between FUSE 2 and 3.
+FUSE_CAP_ASYNC_READ = 1 << 0
+FUSE_CAP_POSIX_LOCKS = 1 << 1
+FUSE_CAP_ATOMIC_O_TRUNC = 1 << 3
+FUSE_CAP_EXPORT_SUPPORT = 1 << 4
+FUSE_CAP_DONT_MASK = 1 << 6
+FUSE_CAP_SPLICE_WRITE = 1 << 7
+FUSE_CAP_SPLICE_MOVE = 1 << 8
+FUSE_CAP_SPLICE_READ = 1 << 9
+FUSE_CAP_FLOCK_LOCKS = 1 << 10
+FUSE_CAP_IOCTL_DIR = 1 << 11
+if fuse_version_major == 2:
+    FUSE_CAP_BIG_WRITES = 1 << 5
+elif fuse_version_major == 3:
+    FUSE_CAP_AUTO_INVAL_DATA = 1 << 12
+    FUSE_CAP_READDIRPLUS = 1 << 13
+    FUSE_CAP_READDIRPLUS_AUTO = 1 << 14
+    FUSE_CAP_ASYNC_DIO = 1 << 15
+    FUSE_CAP_WRITEBACK_CACHE = 1 << 16
+    FUSE_CAP_NO_OPEN_SUPPORT = 1 << 17
+    FUSE_CAP_PARALLEL_DIROPS = 1 << 18
+    FUSE_CAP_POSIX_ACL = 1 << 19
+    FUSE_CAP_HANDLE_KILLPRIV = 1 << 20
+    FUSE_CAP_CACHE_SYMLINKS = 1 << 23
+    FUSE_CAP_NO_OPENDIR_SUPPORT = 1 << 24
+    FUSE_CAP_EXPLICIT_INVAL_DATA = 1 << 25
+
+# All capability flags available for the loaded libfuse version by name.
+_fuse_capabilities = {
+    'FUSE_CAP_ASYNC_READ': FUSE_CAP_ASYNC_READ,
+    'FUSE_CAP_POSIX_LOCKS': FUSE_CAP_POSIX_LOCKS,
+    'FUSE_CAP_ATOMIC_O_TRUNC': FUSE_CAP_ATOMIC_O_TRUNC,
+    'FUSE_CAP_EXPORT_SUPPORT': FUSE_CAP_EXPORT_SUPPORT,
+    'FUSE_CAP_DONT_MASK': FUSE_CAP_DONT_MASK,
+    'FUSE_CAP_SPLICE_WRITE': FUSE_CAP_SPLICE_WRITE,
+    'FUSE_CAP_SPLICE_MOVE': FUSE_CAP_SPLICE_MOVE,
+    'FUSE_CAP_SPLICE_READ': FUSE_CAP_SPLICE_READ,
+    'FUSE_CAP_FLOCK_LOCKS': FUSE_CAP_FLOCK_LOCKS,
+    'FUSE_CAP_IOCTL_DIR': FUSE_CAP_IOCTL_DIR,
+}
+if fuse_version_major == 2:
+    _fuse_capabilities['FUSE_CAP_BIG_WRITES'] = FUSE_CAP_BIG_WRITES
+elif fuse_version_major == 3:
+    _fuse_capabilities.update({
+        'FUSE_CAP_AUTO_INVAL_DATA': FUSE_CAP_AUTO_INVAL_DATA,
+        'FUSE_CAP_READDIRPLUS': FUSE_CAP_READDIRPLUS,
+        'FUSE_CAP_READDIRPLUS_AUTO': FUSE_CAP_READDIRPLUS_AUTO,
+        'FUSE_CAP_ASYNC_DIO': FUSE_CAP_ASYNC_DIO,
+        'FUSE_CAP_WRITEBACK_CACHE': FUSE_CAP_WRITEBACK_CACHE,
+        'FUSE_CAP_NO_OPEN_SUPPORT': FUSE_CAP_NO_OPEN_SUPPORT,
+        'FUSE_CAP_PARALLEL_DIROPS': FUSE_CAP_PARALLEL_DIROPS,
+        'FUSE_CAP_POSIX_ACL': FUSE_CAP_POSIX_ACL,
+        'FUSE_CAP_HANDLE_KILLPRIV': FUSE_CAP_HANDLE_KILLPRIV,
+        'FUSE_CAP_CACHE_SYMLINKS': FUSE_CAP_CACHE_SYMLINKS,
+        'FUSE_CAP_NO_OPENDIR_SUPPORT': FUSE_CAP_NO_OPENDIR_SUPPORT,
+        'FUSE_CAP_EXPLICIT_INVAL_DATA': FUSE_CAP_EXPLICIT_INVAL_DATA,
+    })
+
+
+def fuse_capability_names(flags):
+    'Returns the names of the FUSE_CAP_* constants set in flags.'
+    return [name for name, value in _fuse_capabilities.items() if flags & value]
+
+
 # FUSE 3-only struct for second init argument. If a FUSE 2 method is loaded but 'init_with_config'
 # overridden, then this argument will only be zero-initialized and should be ignored.
 _fuse_config_fields_ = [
@@ -755,7 +925,13 @@ class fuse_config(ctypes.Structure):
     _fields_ = _fuse_config_fields_
 
 
-fuse_pollhandle_p = ctypes.c_void_p  # Not exposed to API
+fuse_pollhandle_p = ctypes.c_void_p  # Wrapped by PollHandle
+
+# Added in 2.8 together with poll.
+if hasattr(_libfuse, 'fuse_notify_poll'):
+    _libfuse.fuse_notify_poll.argtypes = (fuse_pollhandle_p,)
+    _libfuse.fuse_pollhandle_destroy.argtypes = (fuse_pollhandle_p,)
+    _libfuse.fuse_pollhandle_destroy.restype = None
 
 
 # These are unchanged in FUSE 3 and therefore nice to have separate to reduce duplication.
@@ -797,6 +973,8 @@ _fuse_operations_fields_2_9 = [
 ]
 
 if fuse_version_major == 2:
+    fuse_fill_dir_t = CFUNCTYPE(c_int, c_void_p, c_char_p, POINTER(c_stat), c_off_t)
+
     _fuse_operations_fields = [
         ('getattr', CFUNCTYPE(c_int, c_char_p, POINTER(c_stat))),
         ('readlink', CFUNCTYPE(c_int, c_char_p, POINTER(c_byte), c_size_t)),
@@ -813,9 +991,7 @@ if fuse_version_major == 2:
         _fuse_operations_fields += [
             ('opendir', CFUNCTYPE(c_int, c_char_p, POINTER(fuse_file_info))),
             ('readdir', CFUNCTYPE(
-                c_int, c_char_p, c_void_p,
-                CFUNCTYPE(c_int, c_void_p, c_char_p, POINTER(c_stat), c_off_t),
-                c_off_t, POINTER(fuse_file_info))),
+                c_int, c_char_p, c_void_p, fuse_fill_dir_t, c_off_t, POINTER(fuse_file_info))),
             ('releasedir', CFUNCTYPE(c_int, c_char_p, POINTER(fuse_file_info))),
             ('fsyncdir', CFUNCTYPE(c_int, c_char_p, c_int, POINTER(fuse_file_info))),
             ('init', CFUNCTYPE(c_void_p, POINTER(fuse_conn_info))),
@@ -849,7 +1025,7 @@ if fuse_version_major == 2:
     if fuse_version_minor >= 9:
         _fuse_operations_fields += _fuse_operations_fields_2_9
 elif fuse_version_major == 3:
-    fuse_fill_dir_flags = ctypes.c_int  # The only flag in libfuse 3.16 is USE_FILL_DIR_PLUS = (1 << 1).
+    fuse_fill_dir_flags = ctypes.c_int  # The only flag in libfuse 3.16 is FUSE_FILL_DIR_PLUS = (1 << 1).
     fuse_fill_dir_t = CFUNCTYPE(c_int, c_void_p, c_char_p, POINTER(c_stat), c_off_t, fuse_fill_dir_flags)
 
     fuse_readdir_flags = ctypes.c_int  # The only flag in libfuse 3.16 is FUSE_READDIR_PLUS = (1 << 0).
@@ -920,12 +1096,157 @@ class fuse_operations(ctypes.Structure):
     _fields_ = _fuse_operations_fields
 
 
+# The readdir filler prototype but with the stat struct argument as void pointer, so that it can be called
+# with a plain address, which avoids the comparatively expensive argument conversion for POINTER(c_stat).
+if fuse_version_major == 2:
+    _fuse_fill_dir_address_t = CFUNCTYPE(c_int, c_void_p, c_char_p, c_void_p, c_off_t)
+elif fuse_version_major == 3:
+    _fuse_fill_dir_address_t = CFUNCTYPE(c_int, c_void_p, c_char_p, c_void_p, c_off_t, fuse_fill_dir_flags)
+
+
 if _system == "OpenBSD":
     def fuse_main_real(argc, argv, fuse_ops_v, sizeof_fuse_ops, ctx_p):
         return _libfuse.fuse_main(argc, argv, fuse_ops_v, ctx_p)
 else:
     fuse_main_real =_libfuse.fuse_main_real
 
+
+if fuse_version_major == 3:
+    class fuse_args(ctypes.Structure):
+        _fields_ = [
+            ('argc', c_int),
+            ('argv', POINTER(c_char_p)),
+            ('allocated', c_int),
+        ]
+
+    # Public in 3.2 up to 3.11. Since 3.12, the struct is opaque and has to be created and
+    # configured with the fuse_loop_cfg_* functions, which also allow to set max_threads.
+    class fuse_loop_config(ctypes.Structure):
+        _fields_ = [
+            ('clone_fd', c_int),
+            ('max_idle_threads', c_uint),
+        ]
+
+    _libfuse.fuse_new.argtypes = (POINTER(fuse_args), POINTER(fuse_operations), c_size_t, c_void_p)
+    _libfuse.fuse_new.restype = c_void_p
+    _libfuse.fuse_mount.argtypes = (c_void_p, c_char_p)
+    _libfuse.fuse_unmount.argtypes = (c_void_p,)
+    _libfuse.fuse_unmount.restype = None
+    _libfuse.fuse_destroy.argtypes = (c_void_p,)
+    _libfuse.fuse_destroy.restype = None
+    _libfuse.fuse_get_session.argtypes = (c_void_p,)
+    _libfuse.fuse_get_session.restype = c_void_p
+    _libfuse.fuse_set_signal_handlers.argtypes = (c_void_p,)
+    _libfuse.fuse_remove_signal_handlers.argtypes = (c_void_p,)
+    _libfuse.fuse_remove_signal_handlers.restype = None
+    _libfuse.fuse_daemonize.argtypes = (c_int,)
+    _libfuse.fuse_loop.argtypes = (c_void_p,)
+    _libfuse.fuse_opt_free_args.argtypes = (POINTER(fuse_args),)
+    _libfuse.fuse_opt_free_args.restype = None
+    if hasattr(_libfuse, 'fuse_invalidate_path'):
+        _libfuse.fuse_invalidate_path.argtypes = (c_void_p, c_char_p)
+    if fuse_version_minor < 2:
+        _libfuse.fuse_loop_mt.argtypes = (c_void_p, c_int)
+    else:
+        _libfuse.fuse_loop_mt.argtypes = (c_void_p, c_void_p)
+    if hasattr(_libfuse, 'fuse_loop_cfg_create'):
+        _libfuse.fuse_loop_cfg_create.argtypes = ()
+        _libfuse.fuse_loop_cfg_create.restype = c_void_p
+        _libfuse.fuse_loop_cfg_destroy.argtypes = (c_void_p,)
+        _libfuse.fuse_loop_cfg_destroy.restype = None
+        for _name in ('clone_fd', 'idle_threads', 'max_threads'):
+            _setter = getattr(_libfuse, 'fuse_loop_cfg_set_' + _name)
+            _setter.argtypes = (c_void_p, c_uint)
+            _setter.restype = None
+
+
+def _fuse_loop_mt(fuse_ptr, clone_fd=None, max_idle_threads=None, max_threads=None):
+    'Calls fuse_loop_mt with the loop configuration in the form expected by the libfuse 3 version.'
+    if fuse_version_minor < 2:
+        ignored = [name for name, value in (('max_idle_threads', max_idle_threads), ('max_threads', max_threads))
+                   if value is not None]
+        if ignored:
+            warnings.warn(f"Ignoring {', '.join(ignored)}, which requires libfuse 3.2 or newer, "
+                          f"but found {fuse_version_major}.{fuse_version_minor}.")
+        return _libfuse.fuse_loop_mt(fuse_ptr, int(bool(clone_fd)))
+
+    if not hasattr(_libfuse, 'fuse_loop_cfg_create'):
+        if max_threads is not None:
+            warnings.warn(f"Ignoring max_threads, which requires libfuse 3.12 or newer, "
+                          f"but found {fuse_version_major}.{fuse_version_minor}.")
+        config = fuse_loop_config(clone_fd=int(bool(clone_fd)),
+                                  max_idle_threads=10 if max_idle_threads is None else max_idle_threads)
+        return _libfuse.fuse_loop_mt(fuse_ptr, ctypes.addressof(config))
+
+    # Unspecified values keep the libfuse defaults.
+    config = _libfuse.fuse_loop_cfg_create()
+    if not config:
+        return 1
+    try:
+        if clone_fd is not None:
+            _libfuse.fuse_loop_cfg_set_clone_fd(config, int(bool(clone_fd)))
+        if max_idle_threads is not None:
+            _libfuse.fuse_loop_cfg_set_idle_threads(config, max_idle_threads)
+        if max_threads is not None:
+            _libfuse.fuse_loop_cfg_set_max_threads(config, max_threads)
+        return _libfuse.fuse_loop_mt(fuse_ptr, config)
+    finally:
+        _libfuse.fuse_loop_cfg_destroy(config)
+
+
+def fuse_main_loop(args, mountpoint, fuse_ops, foreground=False, singlethread=False, **loop_config):
+    '''
+    Equivalent to fuse_main_real for libfuse 3 but with the multithreaded loop configurable via
+    the clone_fd, max_idle_threads, and max_threads keyword arguments. args is the list of
+    encoded library options without the mount point and without the -f and -s flags, which are
+    specified via foreground and singlethread instead. Like fuse_main_real, the debug option
+    implies foreground. Returns 0 on success like fuse_main_real.
+    '''
+    if fuse_version_major != 3:
+        raise ValueError(
+            f"Configuring the FUSE loop requires libfuse 3, but found {fuse_version_major}.{fuse_version_minor}.")
+
+    # fuse_main_real also runs in the foreground when debugging, which is done by fuse_parse_cmdline.
+    options = []
+    for previous, arg in zip([None] + list(args), args):
+        if previous == b'-o':
+            options.extend(arg.split(b','))
+    if b'-d' in args or b'debug' in options:
+        foreground = True
+
+    argv = (c_char_p * len(args))(*args)
+    fargs = fuse_args(argc=len(args), argv=argv, allocated=0)
+    fuse_ptr = _libfuse.fuse_new(ctypes.byref(fargs), ctypes.byref(fuse_ops), ctypes.sizeof(fuse_ops), None)
+    if not fuse_ptr:
+        _libfuse.fuse_opt_free_args(ctypes.byref(fargs))
+        return 1
+
+    err = 1
+    try:
+        if _libfuse.fuse_mount(fuse_ptr, mountpoint) != 0:
+            return err
+        try:
+            if _libfuse.fuse_daemonize(int(bool(foreground))) != 0:
+                return err
+            session = _libfuse.fuse_get_session(fuse_ptr)
+            if _libfuse.fuse_set_signal_handlers(session) != 0:
+                return err
+            try:
+                if singlethread:
+                    err = _libfuse.fuse_loop(fuse_ptr)
+                else:
+                    err = _fuse_loop_mt(fuse_ptr, **loop_config)
+                err = 1 if err else 0
+            finally:
+                _libfuse.fuse_remove_signal_handlers(session)
+        finally:
+            _libfuse.fuse_unmount(fuse_ptr)
+    finally:
+        _libfuse.fuse_destroy(fuse_ptr)
+        _libfuse.fuse_opt_free_args(ctypes.byref(fargs))
+    return err
+
+
 def time_of_timespec(ts, use_ns=False):
     if use_ns:
         return ts.tv_sec * 10 ** 9 + ts.tv_nsec
@@ -947,6 +1268,91 @@ def set_st_attrs(st, attrs, use_ns=False):
             setattr(st, key, val)
 
 
+def _set_st_attrs_from_any(st, attrs, use_ns=False):
+    'Fills the c_stat from a dictionary as returned by getattr, an os.stat_result, or a c_stat.'
+    if isinstance(attrs, dict):
+        set_st_attrs(st, attrs, use_ns=use_ns)
+    elif isinstance(attrs, os.stat_result):
+        set_st_attrs_from_stat_result(st, attrs)
+    elif isinstance(attrs, c_stat):
+        ctypes.memmove(ctypes.byref(st), ctypes.byref(attrs), ctypes.sizeof(c_stat))
+    else:
+        set_st_attrs(st, attrs, use_ns=use_ns)
+
+
+# Precomputed mapping of os.stat_result members to c_stat members for this platform.
+_stat_result_int_fields = tuple(
+    name for name in (
+        'st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid', 'st_size', 'st_rdev',
+        'st_blksize', 'st_blocks', 'st_flags', 'st_gen')
+    if hasattr(c_stat, name) and hasattr(os.stat_result, name)
+)
+_stat_result_time_fields = tuple(
+    (name + 'spec', name + '_ns') for name in ('st_atime', 'st_mtime', 'st_ctime', 'st_birthtime')
+    if hasattr(c_stat, name + 'spec') and hasattr(os.stat_result, name + '_ns')
+)
+
+def set_st_attrs_from_stat_result(st, result):
+    'Copies all members of an os.stat_result into a c_stat without going through a dictionary.'
+    for name in _stat_result_int_fields:
+        setattr(st, name, getattr(result, name))
+    for timespec_name, ns_name in _stat_result_time_fields:
+        timespec = getattr(st, timespec_name)
+        timespec.tv_sec, timespec.tv_nsec = divmod(getattr(result, ns_name), 10 ** 9)
+
+
+def _memoryview_at(address, size):
+    'Returns a byte memoryview of the given size pointing to the given memory address.'
+    return memoryview((ctypes.c_ubyte * size).from_address(address)).cast('B')
+
+
+_libc = None
+
+def _get_libc():
+    global _libc  # pylint: disable=global-statement
+    if _libc is None:
+        libc = ctypes.CDLL(None)
+        libc.malloc.argtypes = (ctypes.c_size_t,)
+        libc.malloc.restype = ctypes.c_void_p
+        libc.free.argtypes = (ctypes.c_void_p,)
+        libc.free.restype = None
+        _libc = libc
+    return _libc
+
+
+def _malloc(size):
+    '''
+    Memory that is handed over to and freed by libfuse has to be allocated with the C library.
+    '''
+    address = _get_libc().malloc(size)
+    if not address:
+        raise FuseOSError(errno.ENOMEM)
+    return address
+
+
+def _free(address):
+    _get_libc().free(address)
+
+
+def _fuse_bufvec_buffers(bufv):
+    'Returns a pointer to the first of bufv.count fuse_buf elements.'
+    return ctypes.cast(ctypes.byref(bufv, fuse_bufvec.buf.offset), ctypes.POINTER(fuse_buf))
+
+
+def fuse_buf_copy(dst, src, flags=0):
+    '''
+    Copies as much data as possible from the src to the dst fuse_bufvec and returns the number of
+    copied bytes. If both contain file descriptors, then libfuse may use splice to copy the data
+    without it ever being copied into user space memory.
+    '''
+    if not hasattr(_libfuse, 'fuse_buf_copy'):
+        raise FuseOSError(errno.ENOSYS)
+    ret = _libfuse.fuse_buf_copy(ctypes.byref(dst), ctypes.byref(src), flags)
+    if ret < 0:
+        raise FuseOSError(-ret)
+    return ret
+
+
 def fuse_get_context():
     'Returns a (uid, gid, pid) tuple'
 
@@ -955,6 +1361,13 @@ def fuse_get_context():
     return ctx.uid, ctx.gid, ctx.pid
 
 
+def fuse_interrupted():
+    'Returns True if the request currently being handled by the calling thread has been interrupted.'
+    if not hasattr(_libfuse, 'fuse_interrupted'):
+        return False
+    return bool(_libfuse.fuse_interrupted())
+
+
 def fuse_exit():
     '''
     This will shutdown the FUSE mount and cause the call to FUSE(...) to
@@ -970,7 +1383,8 @@ def fuse_exit():
         return
 
     fuse_ptr = ctypes.c_void_p(_libfuse.fuse_get_context().contents.fuse)
-    _libfuse.fuse_exit(fuse_ptr)
+    if fuse_ptr:  # NULL when called outside of a FUSE loop, e.g., from FuseHarness
+        _libfuse.fuse_exit(fuse_ptr)
 
 
 class FuseOSError(OSError):
@@ -978,6 +1392,521 @@ class FuseOSError(OSError):
         super().__init__(errno, os.strerror(errno))
 
 
+class FdBuffer:
+    '''
+    Describes size bytes from a file descriptor. It can be returned from read_buf so that libfuse
+    reads the data directly from fd, possibly using splice. If pos is None, then the data is read
+    from the current file position, else from the given position.
+    If retry is True, then reading will be retried until size bytes have been read or the end of
+    the file has been reached.
+    '''
+
+    __slots__ = ('fd', 'size', 'pos', 'retry')
+
+    def __init__(self, fd, size, pos=None, retry=False):
+        self.fd = fd
+        self.size = size
+        self.pos = pos
+        self.retry = retry
+
+    def __repr__(self):
+        return f'FdBuffer(fd={self.fd}, size={self.size}, pos={self.pos}, retry={self.retry})'
+
+
+class FuseTuning:
+    '''
+    Connection and configuration settings to be applied on initialization
+    when given to FUSE via the tuning argument. Settings left at None keep
+    the libfuse defaults.
+
+    The boolean capability settings are added to, or for False removed from,
+    fuse_conn_info.want. Requested capabilities not supported by the kernel or
+    the libfuse version are skipped with a warning. Further FUSE_CAP_* flags
+    can be requested or removed with the want and no_want bit masks.
+
+    entry_timeout, attr_timeout, negative_timeout (in seconds), kernel_cache,
+    and auto_cache are set in fuse_config with FUSE 3 and passed as mount
+    options with FUSE 2. max_read is also passed as mount option because the
+    kernel only honors it as such. With FUSE 2, max_write is only effective
+    with the big_writes mount option.
+    '''
+
+    __slots__ = (
+        'max_write', 'max_read', 'max_readahead', 'max_background', 'congestion_threshold',
+        'async_read', 'splice_read', 'splice_write', 'splice_move', 'writeback_cache',
+        'parallel_dirops', 'readdirplus_auto', 'want', 'no_want',
+        'entry_timeout', 'attr_timeout', 'negative_timeout', 'kernel_cache', 'auto_cache',
+    )
+
+    _connection_fields = ('max_write', 'max_read', 'max_readahead', 'max_background', 'congestion_threshold')
+    _config_fields = ('entry_timeout', 'attr_timeout', 'negative_timeout', 'kernel_cache', 'auto_cache')
+    _capabilities = (
+        ('async_read', ('FUSE_CAP_ASYNC_READ',)),
+        ('splice_read', ('FUSE_CAP_SPLICE_READ',)),
+        ('splice_write', ('FUSE_CAP_SPLICE_WRITE',)),
+        ('splice_move', ('FUSE_CAP_SPLICE_MOVE',)),
+        ('writeback_cache', ('FUSE_CAP_WRITEBACK_CACHE',)),
+        ('parallel_dirops', ('FUSE_CAP_PARALLEL_DIROPS',)),
+        ('readdirplus_auto', ('FUSE_CAP_READDIRPLUS', 'FUSE_CAP_READDIRPLUS_AUTO')),
+    )
+
+    def __init__(self, max_write=None, max_read=None, max_readahead=None, max_background=None,
+                 congestion_threshold=None, async_read=None, splice_read=None, splice_write=None,
+                 splice_move=None, writeback_cache=None, parallel_dirops=None, readdirplus_auto=None,
+                 want=0, no_want=0, entry_timeout=None, attr_timeout=None, negative_timeout=None,
+                 kernel_cache=None, auto_cache=None):
+        self.max_write = self._check_integer('max_write', max_write)
+        self.max_read = self._check_integer('max_read', max_read)
+        self.max_readahead = self._check_integer('max_readahead', max_readahead)
+        self.max_background = self._check_integer('max_background', max_background)
+        self.congestion_threshold = self._check_integer('congestion_threshold', congestion_threshold)
+        self.async_read = self._check_flag('async_read', async_read)
+        self.splice_read = self._check_flag('splice_read', splice_read)
+        self.splice_write = self._check_flag('splice_write', splice_write)
+        self.splice_move = self._check_flag('splice_move', splice_move)
+        self.writeback_cache = self._check_flag('writeback_cache', writeback_cache)
+        self.parallel_dirops = self._check_flag('parallel_dirops', parallel_dirops)
+        self.readdirplus_auto = self._check_flag('readdirplus_auto', readdirplus_auto)
+        self.want = self._check_integer('want', want, optional=False)
+        self.no_want = self._check_integer('no_want', no_want, optional=False)
+        self.entry_timeout = self._check_seconds('entry_timeout', entry_timeout)
+        self.attr_timeout = self._check_seconds('attr_timeout', attr_timeout)
+        self.negative_timeout = self._check_seconds('negative_timeout', negative_timeout)
+        self.kernel_cache = self._check_flag('kernel_cache', kernel_cache)
+        self.auto_cache = self._check_flag('auto_cache', auto_cache)
+
+    @staticmethod
+    def _check_integer(name, value, optional=True):
+        if value is None and optional:
+            return value
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise TypeError(f"Expected an integer{' or None' if optional else ''} for {name} "
+                            f"but got {type(value).__name__}.")
+        if value < 0:
+            raise ValueError(f"Expected {name} to be non-negative but got {value}.")
+        return value
+
+    @staticmethod
+    def _check_seconds(name, value):
+        if value is None:
+            return value
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise TypeError(f"Expected a number of seconds or None for {name} but got {type(value).__name__}.")
+        if not value >= 0:
+            raise ValueError(f"Expected {name} to be non-negative but got {value}.")
+        return value
+
+    @staticmethod
+    def _check_flag(name, value):
+        if value is not None and not isinstance(value, bool):
+            raise TypeError(f"Expected True, False, or None for {name} but got {type(value).__name__}.")
+        return value
+
+    def __repr__(self):
+        settings = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__
+                             if getattr(self, name) is not None
+                             and not (name in ('want', 'no_want') and not getattr(self, name)))
+        return f'FuseTuning({settings})'
+
+    def mount_options(self):
+        'Returns the settings that have to be specified as mount options as dictionary.'
+        options = {}
+        if self.max_read is not None:
+            options['max_read'] = self.max_read
+        if fuse_version_major == 2:
+            for name in self._config_fields:
+                value = getattr(self, name)
+                if value is not None:
+                    options[name] = value
+        return options
+
+    def capabilities(self):
+        'Returns the FUSE_CAP_* bit masks to be added to and removed from the wanted capabilities.'
+        want, no_want = self.want, self.no_want
+        for name, flag_names in self._capabilities:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            flags = [_fuse_capabilities.get(flag_name) for flag_name in flag_names]
+            if None in flags:
+                if value:
+                    warnings.warn(f"Ignoring {name}, which is not supported by libfuse "
+                                  f"{fuse_version_major}.{fuse_version_minor}.")
+                continue
+            if value:
+                for flag in flags:
+                    want |= flag
+            else:
+                no_want |= flags[-1]
+        return want, no_want
+
+    def apply(self, conn, config=None):
+        'Applies the settings to the given fuse_conn_info and, if not None, fuse_config structs.'
+        for name in self._connection_fields:
+            value = getattr(self, name)
+            if value is not None and hasattr(conn, name):
+                setattr(conn, name, value)
+        if self.async_read is not None and hasattr(conn, 'async_read'):
+            conn.async_read = bool(self.async_read)
+
+        want, no_want = self.capabilities()
+        if want & ~conn.capable:
+            log.warning("Requested FUSE capabilities are not supported and will be ignored: %s",
+                        ', '.join(fuse_capability_names(want & ~conn.capable)))
+        conn.want = (conn.want | (want & conn.capable)) & ~no_want
+
+        if config is not None:
+            for name in self._config_fields:
+                value = getattr(self, name)
+                if value is not None:
+                    setattr(config, name, value)
+
+
+def _log_connection_info(conn, config=None):
+    settings = ', '.join(f'{name}={getattr(conn, name)}' for name, _ in conn._fields_
+                         if name not in ('capable', 'want', 'reserved'))
+    log.info("FUSE connection: %s, want=%s", settings, '|'.join(fuse_capability_names(conn.want)))
+    if config is not None:
+        log.info("FUSE config: %s", ', '.join(f'{name}={getattr(config, name)}' for name in FuseTuning._config_fields))
+
+
+def _new_fuse_bufvec(buffers, size):
+    '''
+    Returns a pointer to a fuse_bufvec allocated with malloc, so that it can be freed by libfuse
+    after a read_buf call. Buffers may be a single or a list of FdBuffer or bytes-like objects.
+    The latter are copied into memory allocated with malloc, which is also freed by libfuse.
+    Buffers beyond the requested size in total are truncated.
+    '''
+    if buffers is None:
+        buffers = []
+    elif isinstance(buffers, FdBuffer) or not isinstance(buffers, (list, tuple)):
+        buffers = [buffers]
+
+    # Check and truncate all buffers before allocating anything, so that invalid ones cannot leak memory.
+    items = []
+    remaining = size
+    for buffer in buffers:
+        if remaining <= 0:
+            break
+        if isinstance(buffer, FdBuffer):
+            length = min(buffer.size, remaining)
+        else:
+            buffer = memoryview(buffer).cast('B')
+            length = min(buffer.nbytes, remaining)
+            buffer = buffer[:length]
+        if length > 0:
+            items.append((buffer, length))
+            remaining -= length
+
+    count = max(1, len(items))
+    bufv_size = ctypes.sizeof(fuse_bufvec) + (count - 1) * ctypes.sizeof(fuse_buf)
+    address = _malloc(bufv_size)
+    allocated = [address]
+    try:
+        ctypes.memset(address, 0, bufv_size)
+        bufv = fuse_bufvec.from_address(address)
+        bufv.count = count
+
+        fbufs = _fuse_bufvec_buffers(bufv)
+        for i, (buffer, length) in enumerate(items):
+            fbuf = fbufs[i]
+            if isinstance(buffer, FdBuffer):
+                fbuf.flags = FUSE_BUF_IS_FD
+                if buffer.pos is not None:
+                    fbuf.flags |= FUSE_BUF_FD_SEEK
+                    fbuf.pos = buffer.pos
+                if buffer.retry:
+                    fbuf.flags |= FUSE_BUF_FD_RETRY
+                fbuf.fd = buffer.fd
+            else:
+                fbuf.mem = _malloc(length)
+                allocated.append(fbuf.mem)
+                _memoryview_at(fbuf.mem, length)[:] = buffer
+            fbuf.size = length
+    except BaseException:
+        for allocation in allocated:
+            _free(allocation)
+        raise
+
+    return ctypes.pointer(bufv)
+
+
+class PollHandle:
+    '''
+    Poll handle given to Operations.poll when the kernel wants to be notified about readiness
+    changes. Call notify when the file becomes ready to wake up the waiters, which then call poll
+    again. A single notification suffices for all preceding poll calls, so it is enough to keep
+    the latest handle, e.g., per file handle. The libfuse handle is destroyed when this object is
+    garbage-collected or when destroy is called.
+    '''
+
+    __slots__ = ('_handle', '_lock')
+
+    def __init__(self, handle):
+        self._handle = handle
+        self._lock = threading.Lock()
+
+    def notify(self):
+        with self._lock:
+            if self._handle is None:
+                raise ValueError("The poll handle has already been destroyed.")
+            ret = _libfuse.fuse_notify_poll(self._handle)
+        if ret < 0:
+            raise FuseOSError(-ret)
+
+    def destroy(self):
+        with self._lock:
+            handle, self._handle = self._handle, None
+        if handle is not None:
+            _libfuse.fuse_pollhandle_destroy(handle)
+
+    def __del__(self):
+        self.destroy()
+
+
+def set_revents(reventsp, revents):
+    '''
+    Sets the ready events, e.g., select.POLLIN, for the reventsp argument of Operations.poll
+    and returns 0, so that poll can simply return the result.
+    '''
+    reventsp[0] = revents
+    return 0
+
+
+class BufferVector:
+    '''
+    Wraps the fuse_bufvec given to write_buf. The contained buffers are only valid for the
+    duration of the call. They can either be accessed as memoryviews and FdBuffer objects
+    with buffers, copied into a bytes object with tobytes, or be copied to a file descriptor
+    with copy_to_fd, which avoids any copy into user space if libfuse can use splice.
+    '''
+
+    def __init__(self, bufv):
+        self.bufv = bufv
+
+    def __len__(self):
+        size = 0
+        for buffer in self.buffers():
+            size += buffer.size if isinstance(buffer, FdBuffer) else buffer.nbytes
+        return size
+
+    def buffers(self):
+        'Yields a memoryview or a FdBuffer for each buffer.'
+        bufv = self.bufv
+        fbufs = _fuse_bufvec_buffers(bufv)
+        for i in range(bufv.idx, bufv.count):
+            fbuf = fbufs[i]
+            offset = bufv.off if i == bufv.idx else 0
+            if fbuf.flags & FUSE_BUF_IS_FD:
+                pos = fbuf.pos + offset if fbuf.flags & FUSE_BUF_FD_SEEK else None
+                yield FdBuffer(fbuf.fd, fbuf.size - offset, pos, bool(fbuf.flags & FUSE_BUF_FD_RETRY))
+            else:
+                yield _memoryview_at((fbuf.mem or 0) + offset, fbuf.size - offset).toreadonly()
+
+    def copy_to_fd(self, fd, pos=None, flags=0):
+        '''
+        Copies all data to the given file descriptor at the given position or, if pos is None,
+        at the current file position and returns the number of bytes written.
+        '''
+        dst = fuse_bufvec(count=1)
+        dst.buf[0].size = len(self)
+        dst.buf[0].fd = fd
+        dst.buf[0].flags = FUSE_BUF_IS_FD
+        if pos is not None:
+            dst.buf[0].flags |= FUSE_BUF_FD_SEEK
+            dst.buf[0].pos = pos
+        return fuse_buf_copy(dst, self.bufv, flags)
+
+    def tobytes(self):
+        size = len(self)
+        data = ctypes.create_string_buffer(size)
+        dst = fuse_bufvec(count=1)
+        dst.buf[0].size = size
+        dst.buf[0].mem = ctypes.addressof(data)
+        size = fuse_buf_copy(dst, self.bufv)
+        return data.raw[:size]
+
+
+class _OperationsDispatcher:
+    '''
+    Resolves each operation once on first use to avoid going through Operations.__call__ with its
+    hasattr and getattr calls on each request. The resolved callable is cached as an attribute
+    of this object. A custom __call__ implementation, e.g., from LoggingMixIn, is still honored.
+    If a recorder is given, all operation calls are recorded with it.
+    '''
+
+    def __init__(self, operations, recorder=None):
+        self._operations = operations
+        self._recorder = recorder
+        call = getattr(type(operations), '__call__', None)
+        self._use_call = call is not Operations.__call__ and call is not AsyncOperations.__call__
+        self._run_coroutine = getattr(operations, 'run_coroutine', None)
+
+    def __getattr__(self, name):
+        # Only called for attributes that have not been resolved yet.
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        if self._use_call:
+            method = partial(self._operations, name)
+        else:
+            method = getattr(self._operations, name, None)
+            if method is None:
+                method = partial(_raise_fuse_os_error, errno.EFAULT)
+
+        if self._run_coroutine is not None:
+            # Not only coroutine functions but also, e.g., Cython functions may return awaitables.
+            method = partial(_call_and_run_coroutine, self._run_coroutine, method)
+
+        if self._recorder is not None:
+            method = self._recorder.wrap(name, method)
+
+        setattr(self, name, method)
+        return method
+
+
+def _raise_fuse_os_error(error, *args):
+    raise FuseOSError(error)
+
+
+def _call_and_run_coroutine(run_coroutine, method, *args):
+    # A custom __call__, e.g., from LoggingMixIn, might return the coroutine as is.
+    result = method(*args)
+    if _is_awaitable(result):
+        return run_coroutine(result)
+    return result
+
+
+def _is_awaitable(value):
+    # Cheaper than inspect.isawaitable and avoids importing inspect. Generator-based coroutines
+    # decorated with types.coroutine are not supported.
+    return hasattr(type(value), '__await__')
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+class _OperationStats:
+    'Counters for one operation, updated by FUSE._wrapper when metrics are enabled.'
+
+    __slots__ = ('calls', 'in_flight', 'errors', 'bytes', 'total_ns', 'buckets', 'lock')
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.errors = {}
+        self.bytes = 0
+        self.total_ns = 0
+        # Bucket i counts durations in [2**(i - 1), 2**i) nanoseconds.
+        self.buckets = [0] * 64
+        self.lock = threading.Lock()
+
+
+class _Metrics:
+    '''
+    Per-operation call and error counts, transferred bytes, in-flight gauges, and latency
+    histograms with logarithmic buckets. Optionally, the metrics are periodically written
+    to a file in the Prometheus text format.
+    '''
+
+    # Operations returning the number of transferred bytes, or for read_buf, the returned buffers
+    byte_count_operations = ('read', 'read_buf', 'write', 'write_buf', 'copy_file_range')
+
+    def __init__(self):
+        self.operations = {}
+        self._dump_thread = None
+        self._dump_stop = threading.Event()
+
+    def operation(self, name):
+        return self.operations.setdefault(name, _OperationStats())
+
+    def snapshot(self):
+        stats = {}
+        for name, op in sorted(self.operations.items()):
+            with op.lock:
+                stats[name] = {
+                    'calls': op.calls,
+                    'in_flight': op.in_flight,
+                    'errors': {errno.errorcode.get(error, str(error)): count
+                               for error, count in op.errors.items()},
+                    'bytes': op.bytes,
+                    'total_seconds': op.total_ns / 1e9,
+                    'latency_histogram': {2 ** i: count for i, count in enumerate(op.buckets) if count},
+                }
+        return stats
+
+    def prometheus_text(self):
+        lines = []
+        stats = self.snapshot()
+
+        def add_metric(name, metric_type, description, samples):
+            lines.append(f'# HELP fuse_{name} {description}')
+            lines.append(f'# TYPE fuse_{name} {metric_type}')
+            lines.extend(f'fuse_{sample}' for sample in samples)
+
+        add_metric('operations_total', 'counter', 'Number of completed FUSE operations.',
+                   (f'operations_total{{operation="{op}"}} {s["calls"]}' for op, s in stats.items()))
+        add_metric('operation_errors_total', 'counter', 'Number of FUSE operations that returned an error.',
+                   (f'operation_errors_total{{operation="{op}",errno="{error}"}} {count}'
+                    for op, s in stats.items() for error, count in sorted(s['errors'].items())))
+        add_metric('operation_bytes_total', 'counter', 'Number of bytes transferred by FUSE operations.',
+                   (f'operation_bytes_total{{operation="{op}"}} {s["bytes"]}'
+                    for op, s in stats.items() if op in self.byte_count_operations))
+        add_metric('operations_in_flight', 'gauge', 'Number of FUSE operations currently being processed.',
+                   (f'operations_in_flight{{operation="{op}"}} {s["in_flight"]}' for op, s in stats.items()))
+
+        # Export a fixed range of buckets from ~1 us to ~69 s so that the set of time series is stable.
+        samples = []
+        for op, s in stats.items():
+            histogram = s['latency_histogram']
+            cumulative = sum(count for bound, count in histogram.items() if bound < 2 ** 10)
+            for exponent in range(10, 37):
+                cumulative += histogram.get(2 ** exponent, 0)
+                samples.append(f'operation_duration_seconds_bucket{{operation="{op}",'
+                               f'le="{2 ** exponent / 1e9:g}"}} {cumulative}')
+            cumulative = s['calls']
+            samples.append(f'operation_duration_seconds_bucket{{operation="{op}",le="+Inf"}} {cumulative}')
+            samples.append(f'operation_duration_seconds_sum{{operation="{op}"}} {s["total_seconds"]}')
+            samples.append(f'operation_duration_seconds_count{{operation="{op}"}} {cumulative}')
+        add_metric('operation_duration_seconds', 'histogram', 'Duration of FUSE operations.', samples)
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus_file(self, path):
+        # Write to a temporary file first so that readers never see a partially written file.
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def start_dump(self, path, interval):
+        if self._dump_thread is not None:
+            return
+
+        def dump():
+            while not self._dump_stop.wait(interval):
+                try:
+                    self.write_prometheus_file(path)
+                except OSError:
+                    log.warning("Failed to write FUSE metrics to %s", path, exc_info=True)
+
+        self._dump_stop.clear()
+        self._dump_thread = threading.Thread(target=dump, name='fuse-metrics', daemon=True)
+        self._dump_thread.start()
+
+    def stop_dump(self, path):
+        if self._dump_thread is None:
+            return
+        self._dump_stop.set()
+        self._dump_thread.join()
+        self._dump_thread = None
+        try:
+            self.write_prometheus_file(path)
+        except OSError:
+            log.warning("Failed to write FUSE metrics to %s", path, exc_info=True)
+
+
 class FUSE():
     '''
     This class is the lower level interface and should not be subclassed under
@@ -993,21 +1922,142 @@ class FUSE():
     )
 
     def __init__(self, operations, mountpoint, raw_fi=False, encoding='utf-8',
-                 **kwargs):
+                 path_type=None, clone_fd=None, max_idle_threads=None, max_threads=None,
+                 tuning=None, metrics=False, metrics_file=None, metrics_interval=10.0,
+                 record_file=None, **kwargs):
 
         '''
         Setting raw_fi to True will cause FUSE to pass the fuse_file_info
         class as is to Operations, instead of just the fh field.
 
         This gives you access to direct_io, keep_cache, etc.
+
+        Setting path_type to bytes will cause FUSE to pass all paths and names
+        as bytes to Operations and to expect bytes for returned paths and names,
+        e.g., from readdir, readlink, and listxattr, instead of decoding and
+        encoding them with the given encoding. If not specified, the path_type
+        property of the operations class is used, which defaults to str.
+
+        Specifying any of clone_fd, max_idle_threads, or max_threads mounts via
+        fuse_new, fuse_mount, and fuse_loop_mt instead of fuse_main_real, which
+        makes it possible to configure the worker threads of the multithreaded
+        loop. Setting clone_fd to True uses a separate /dev/fuse file descriptor
+        for each worker thread. max_idle_threads limits the number of threads kept
+        waiting for requests and max_threads, which requires libfuse 3.12, limits
+        the total number of worker threads. These require libfuse 3.
+
+        tuning may be a FuseTuning object with connection and configuration
+        settings, which are applied on initialization before calling
+        Operations.init. The resulting settings are logged.
+
+        Setting metrics to True enables per-operation call and error counts,
+        transferred bytes, in-flight gauges, and latency histograms, which can
+        be queried with the stats and prometheus_metrics methods. If
+        metrics_file is specified, metrics are enabled and written to that file
+        in the Prometheus text format every metrics_interval seconds and after
+        unmounting. Without metrics, there is no overhead.
+
+        If record_file is specified, all calls to operations are recorded with
+        their arguments and timing into that file, which can be replayed
+        without mounting by replay_recording. Data payloads are only recorded
+        by size. This requires raw_fi to be False.
         '''
 
+        loop_config = {'clone_fd': clone_fd, 'max_idle_threads': max_idle_threads,
+                       'max_threads': max_threads}
+        loop_config = {key: value for key, value in loop_config.items() if value is not None}
+        if loop_config and fuse_version_major != 3:
+            raise ValueError(f"Configuring the FUSE loop ({', '.join(loop_config)}) requires libfuse 3.")
+
+        self._setup(operations, raw_fi=raw_fi, encoding=encoding, path_type=path_type, tuning=tuning,
+                    metrics=metrics, metrics_file=metrics_file, metrics_interval=metrics_interval,
+                    record_file=record_file)
+
+        try:
+            args = ['fuse']
+
+            flags = {arg: kwargs.pop(arg, False) for arg, flag in self.OPTIONS}
+            # fuse_new does not accept the -f and -s flags, which are passed to fuse_main_loop instead.
+            excluded = ('-f', '-s') if loop_config else ()
+            args.extend(flag for arg, flag in self.OPTIONS if flags[arg] and flag not in excluded)
+
+            kwargs.setdefault('fsname', operations.__class__.__name__)
+            if tuning is not None:
+                for key, value in tuning.mount_options().items():
+                    kwargs.setdefault(key, value)
+            args.append('-o')
+            args.append(','.join(self._normalize_fuse_options(**kwargs)))
+            if not loop_config:
+                args.append(mountpoint)
+
+            args = [arg.encode(encoding) for arg in args]
+
+            fuse_ops = self._make_fuse_operations()
+
+            try:
+                old_handler = signal(SIGINT, SIG_DFL)
+            except ValueError:
+                old_handler = SIG_DFL
+
+            if loop_config:
+                err = fuse_main_loop(
+                    args, mountpoint.encode(encoding), fuse_ops, foreground=flags['foreground'],
+                    singlethread=flags['nothreads'], **loop_config)
+            else:
+                argv = (ctypes.c_char_p * len(args))(*args)
+                err = fuse_main_real(
+                    len(args), argv, ctypes.pointer(fuse_ops),
+                    ctypes.sizeof(fuse_ops),
+                    None)
+
+            try:
+                signal(SIGINT, old_handler)
+            except ValueError:
+                pass
+        finally:
+            self._teardown()
+        self._raise_critical_exception()
+        if err:
+            raise RuntimeError(err)
+
+    def _setup(self, operations, raw_fi=False, encoding='utf-8', path_type=None, tuning=None,
+               metrics=False, metrics_file=None, metrics_interval=10.0, record_file=None):
+        'Sets up everything needed for calling the operations from the callbacks.'
+        if record_file is not None and raw_fi:
+            raise ValueError("Recording operations requires raw_fi to be False.")
         self.operations = operations
         self.raw_fi = raw_fi
         self.encoding = encoding
+        self.tuning = tuning
+        self._fuse_ptr = None
+        self._metrics = _Metrics() if metrics or metrics_file else None
+        self._metrics_file = metrics_file
+        self._metrics_interval = metrics_interval
         self.__critical_exception = None
 
+        self.path_type = path_type or getattr(operations, 'path_type', str)
+        if self.path_type is bytes:
+            self._decode_path = self._encode_path = _identity
+        elif self.path_type is str:
+            # Calling the unbound methods without the encoding argument is faster than
+            # path.decode(self.encoding) and the default encoding is UTF-8.
+            if codecs.lookup(encoding).name == 'utf-8':
+                self._decode_path, self._encode_path = bytes.decode, str.encode
+            else:
+                self._decode_path = methodcaller('decode', encoding)
+                self._encode_path = methodcaller('encode', encoding)
+        else:
+            raise ValueError(f"Unsupported path type {self.path_type}. Expected str or bytes.")
+
         self.use_ns = getattr(operations, 'use_ns', False)
+        self.write_memoryview = getattr(operations, 'write_memoryview', False)
+        self._want_writeback_cache = getattr(operations, 'writeback_cache', False)
+        self.writeback_cache = False  # Set to whether it has been negotiated in init
+        if self._want_writeback_cache and fuse_version_major != 3:
+            warnings.warn("The writeback cache requires libfuse 3 and will not be enabled.")
+        self._use_readinto = _is_implemented(operations, 'readinto')
+        self._use_getattr_into = _is_implemented(operations, 'getattr_into')
+        self._use_readdir_from = _is_implemented(operations, 'readdir_from')
         if not self.use_ns:
             warnings.warn(
                 'Time as floating point seconds for utimens is deprecated!\n'
@@ -1016,19 +2066,20 @@ class FUSE():
                 'requirements to <4.',
                 DeprecationWarning)
 
-        args = ['fuse']
-
-        args.extend(flag for arg, flag in self.OPTIONS
-                    if kwargs.pop(arg, False))
-
-        kwargs.setdefault('fsname', operations.__class__.__name__)
-        args.append('-o')
-        args.append(','.join(self._normalize_fuse_options(**kwargs)))
-        args.append(mountpoint)
-
-        args = [arg.encode(encoding) for arg in args]
-        argv = (ctypes.c_char_p * len(args))(*args)
+        # Resources that _teardown releases are acquired last, after everything that can fail.
+        self._recorder = OperationRecorder(record_file) if record_file is not None else None
+        self._ops = _OperationsDispatcher(operations, self._recorder)
+        # FUSE blocks until unmounted, so this is the only way to reach it while mounted, e.g., for
+        # invalidate_path. Attributes named fuse that are already set are left alone.
+        if getattr(operations, 'fuse', None) is None:
+            try:
+                operations.fuse = self
+            except AttributeError:
+                pass
 
+    def _make_fuse_operations(self):
+        'Returns a fuse_operations struct with callbacks for all implemented operations.'
+        operations = self.operations
         fuse_ops = fuse_operations()
         for ent in fuse_operations._fields_:
             name, prototype = ent[:2]
@@ -1040,38 +2091,46 @@ class FUSE():
             if check_name in ["ftruncate", "fgetattr"]:
                 check_name = check_name[1:]
 
+            # read() is implemented in terms of readinto() if the latter exists
+            if check_name == 'read' and self._use_readinto:
+                check_name = 'readinto'
+            if check_name == 'readdir' and self._use_readdir_from:
+                check_name = 'readdir_from'
+
             val = getattr(operations, check_name, None)
             if val is None or getattr(val, 'libfuse_ignore', False):
-                continue
+                # init is always registered because it is needed to remember the fuse pointer for
+                # the cache invalidation methods, to apply the tuning settings, and for init_with_config.
+                if name != 'init':
+                    continue
 
             # Function pointer members are tested for using the
-            # getattr(operations, name) above but are dynamically
-            # invoked using self.operations(name)
+            # getattr(operations, name) above but are invoked using
+            # the methods resolved once by self._ops
             if hasattr(prototype, 'argtypes'):
-                val = prototype(partial(self._wrapper, getattr(self, name)))
+                val = prototype(self._wrapper(getattr(self, name), name))
 
             setattr(fuse_ops, name, val)
-
-        try:
-            old_handler = signal(SIGINT, SIG_DFL)
-        except ValueError:
-            old_handler = SIG_DFL
-
-        err = fuse_main_real(
-            len(args), argv, ctypes.pointer(fuse_ops),
-            ctypes.sizeof(fuse_ops),
-            None)
-
-        try:
-            signal(SIGINT, old_handler)
-        except ValueError:
-            pass
-
+        return fuse_ops
+
+    def _teardown(self):
+        self._fuse_ptr = None
+        if self._metrics_file:
+            self._metrics.stop_dump(self._metrics_file)
+        if self._recorder is not None:
+            self._recorder.close()
+        if isinstance(self.operations, AsyncOperations):
+            self.operations.close_event_loop()
+        if getattr(self.operations, 'fuse', None) is self:
+            self.operations.fuse = None
+
+        del self._ops
         del self.operations     # Invoke the destructor
-        if self.__critical_exception:
-            raise self.__critical_exception
-        if err:
-            raise RuntimeError(err)
+
+    def _raise_critical_exception(self):
+        exception, self.__critical_exception = self.__critical_exception, None
+        if exception:
+            raise exception
 
     @staticmethod
     def _normalize_fuse_options(**kargs):
@@ -1082,23 +2141,95 @@ class FUSE():
             else:
                 yield f'{key}={value}'
 
-    def _wrapper(self, func, *args, **kwargs):
+    def _wrapper(self, func, name=None):
         'Decorator for the methods that follow'
 
+        handle_exception = self._handle_exception
+
+        if self._metrics is not None:
+            return self._metrics_wrapper(func, name or func.__name__)
+
+        # This closure is called for each FUSE operation, so keep it as lean as possible.
+        def wrapper(*args):
+            try:
+                return func(*args) or 0
+            except BaseException as e:  # pylint: disable=broad-exception-caught
+                return handle_exception(func, e)
+
+        wrapper.__name__ = func.__name__
+        return wrapper
+
+    def _metrics_wrapper(self, func, name):
+        handle_exception = self._handle_exception
+        stats = self._metrics.operation(name)
+        count_bytes = name in _Metrics.byte_count_operations
+        count_buffer_bytes = name == 'read_buf'
+        lock = stats.lock
+        perf_counter_ns = time.perf_counter_ns
+
+        def wrapper(*args):
+            with lock:
+                stats.in_flight += 1
+            start = perf_counter_ns()
+            try:
+                result = func(*args) or 0
+            except BaseException as e:  # pylint: disable=broad-exception-caught
+                result = handle_exception(func, e)
+            duration = perf_counter_ns() - start
+            # read_buf returns 0 on success and the data in the fuse_bufvec stored into bufpp.
+            byte_count = result
+            if count_buffer_bytes and result == 0 and args[1][0]:
+                bufv = args[1][0].contents
+                fbufs = _fuse_bufvec_buffers(bufv)
+                byte_count = sum(fbufs[i].size for i in range(bufv.count))
+
+            with lock:
+                stats.in_flight -= 1
+                stats.calls += 1
+                stats.total_ns += duration
+                stats.buckets[min(duration.bit_length(), 63)] += 1
+                if result.__class__ is int:
+                    if result < 0:
+                        stats.errors[-result] = stats.errors.get(-result, 0) + 1
+                    elif count_bytes:
+                        stats.bytes += byte_count
+            return result
+
+        wrapper.__name__ = func.__name__
+        return wrapper
+
+    def stats(self):
+        '''
+        Returns a dictionary mapping operation names to dictionaries with the number of calls,
+        in-flight calls, errors per errno name, transferred bytes, total duration in seconds, and
+        a latency histogram mapping the upper bound in nanoseconds to the number of calls.
+        Returns an empty dictionary if metrics are not enabled. While mounted, this can be called
+        via the fuse attribute of the operations object.
+        '''
+        return self._metrics.snapshot() if self._metrics is not None else {}
+
+    def prometheus_metrics(self):
+        'Returns the metrics in the Prometheus text format, or an empty string if they are not enabled.'
+        return self._metrics.prometheus_text() if self._metrics is not None else ''
+
+    def _handle_exception(self, func, e):
         # Catch exceptions generically so that the whole filesystem does not crash on each fusepy user
         # error. 'init' must not fail because its return code is just stored as private_data field of
         # struct fuse_contex.
         try:
-            try:
-                return func(*args, **kwargs) or 0
+            if not isinstance(e, Exception):
+                raise e
 
-            except OSError as e:
+            if isinstance(e, OSError):
                 if func.__name__ == "init":
                     raise e
                 if isinstance(e.errno, int) and e.errno > 0:
-                    log.debug(
-                        "FUSE operation %s raised a %s, returning errno %s.",
-                        func.__name__, type(e), e.errno, exc_info=True)
+                    # Expected errors such as ENOENT can be very frequent, so avoid any overhead
+                    # for formatting the log message and traceback if it would not be shown anyway.
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug(
+                            "FUSE operation %s raised a %s, returning errno %s.",
+                            func.__name__, type(e), e.errno, exc_info=True)
                     return -e.errno
                 log.error(
                     "FUSE operation %s raised an OSError with negative "
@@ -1106,15 +2237,14 @@ class FUSE():
                     func.__name__, e.errno, exc_info=True)
                 return -errno.EINVAL
 
-            except Exception as e:
-                if func.__name__ == "init":
-                    raise e
-                log.error("Uncaught exception from FUSE operation %s, "
-                          "returning errno.EINVAL.",
-                          func.__name__, exc_info=True)
-                return -errno.EINVAL
+            if func.__name__ == "init":
+                raise e
+            log.error("Uncaught exception from FUSE operation %s, "
+                      "returning errno.EINVAL.",
+                      func.__name__, exc_info=True)
+            return -errno.EINVAL
 
-        except BaseException as e:
+        except BaseException as e:  # pylint: disable=broad-exception-caught
             self.__critical_exception = e
             log.critical(
                 "Uncaught critical exception from FUSE operation %s, aborting.",
@@ -1130,7 +2260,7 @@ class FUSE():
         #     *not* as a generic path decoding method
         if path is None:
             return None
-        return path.decode(self.encoding)
+        return self._decode_path(path)
 
     if fuse_version_major == 2:
         def getattr(self, path, buf):
@@ -1140,7 +2270,10 @@ class FUSE():
             return self.fgetattr(path, buf, None)
 
     def readlink(self, path, buf, bufsize):
-        ret = self.operations('readlink', path.decode(self.encoding)).encode(self.encoding)
+        ret = self._ops.readlink(self._decode_path(path))
+        if isinstance(ret, int):
+            return ret
+        ret = self._encode_path(ret)
 
         # copies a string into the given buffer
         # (null terminated and truncated if necessary)
@@ -1149,42 +2282,42 @@ class FUSE():
         return 0
 
     def mknod(self, path, mode, dev):
-        return self.operations('mknod', path.decode(self.encoding), mode, dev)
+        return self._ops.mknod(self._decode_path(path), mode, dev)
 
     def mkdir(self, path, mode):
-        return self.operations('mkdir', path.decode(self.encoding), mode)
+        return self._ops.mkdir(self._decode_path(path), mode)
 
     def unlink(self, path):
-        return self.operations('unlink', path.decode(self.encoding))
+        return self._ops.unlink(self._decode_path(path))
 
     def rmdir(self, path):
-        return self.operations('rmdir', path.decode(self.encoding))
+        return self._ops.rmdir(self._decode_path(path))
 
     def symlink(self, source, target):
         'creates a symlink `target -> source` (e.g. ln -s source target)'
 
-        return self.operations('symlink', target.decode(self.encoding), source.decode(self.encoding))
+        return self._ops.symlink(self._decode_path(target), self._decode_path(source))
 
     def _rename(self, old, new):
-        return self.operations('rename', old.decode(self.encoding), new.decode(self.encoding))
+        return self._ops.rename(self._decode_path(old), self._decode_path(new))
 
     if fuse_version_major == 2:
         rename = _rename
     elif fuse_version_major == 3:
         def rename(self, old, new, flags):
-            self._rename(old, new)
+            return self._rename(old, new)
 
     def link(self, source, target):
         'creates a hard link `target -> source` (e.g. ln source target)'
 
-        return self.operations('link', target.decode(self.encoding), source.decode(self.encoding))
+        return self._ops.link(self._decode_path(target), self._decode_path(source))
 
     if fuse_version_major == 2:
         def chmod(self, path, mode):
-            return self.operations('chmod', path.decode(self.encoding), mode)
+            return self._ops.chmod(self._decode_path(path), mode)
     elif fuse_version_major == 3:
         def chmod(self, path, mode, fip):
-            return self.operations('chmod', path.decode(self.encoding), mode)
+            return self._ops.chmod(self._decode_path(path), mode)
 
     def _chown(self, path, uid, gid):
         # Check if any of the arguments is a -1 that has overflowed
@@ -1193,7 +2326,7 @@ class FUSE():
         if c_gid_t(gid + 1).value == 0:
             gid = -1
 
-        return self.operations('chown', path.decode(self.encoding), uid, gid)
+        return self._ops.chown(self._decode_path(path), uid, gid)
 
     if fuse_version_major == 2:
         def chown(self, path, uid, gid):
@@ -1204,24 +2337,34 @@ class FUSE():
 
     if fuse_version_major == 2:
         def truncate(self, path, length):
-            return self.operations('truncate', path.decode(self.encoding), length)
+            return self._ops.truncate(self._decode_path(path), length)
     elif fuse_version_major == 3:
         def truncate(self, path, length, fip):
-            return self.operations('truncate', path.decode(self.encoding), length)
+            return self._ops.truncate(self._decode_path(path), length)
 
     def open(self, path, fip):
         fi = fip.contents
+        if self.writeback_cache:
+            fi.flags = _writeback_cache_open_flags(fi.flags)
         if self.raw_fi:
-            return self.operations('open', path.decode(self.encoding), fi)
-        fi.fh = self.operations('open', path.decode(self.encoding), fi.flags)
+            return self._ops.open(self._decode_path(path), fi)
+        fh = self._ops.open(self._decode_path(path), fi.flags)
+        if fh < 0:
+            return fh
+        fi.fh = fh
         return 0
 
     def read(self, path, buf, size, offset, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        ret = self.operations('read', self._decode_optional_path(path), size, offset, fh)
+        if self._use_readinto:
+            return self._readinto(path, buf, size, offset, fh)
+
+        ret = self._ops.read(self._decode_optional_path(path), size, offset, fh)
 
         if not ret:
             return 0
+        if isinstance(ret, int):
+            return ret
 
         retsize = len(ret)
         assert retsize <= size, f'actual amount read {retsize} greater than expected {size}'
@@ -1229,14 +2372,38 @@ class FUSE():
         ctypes.memmove(buf, ret, retsize)
         return retsize
 
+    def _readinto(self, path, buf, size, offset, fh):
+        # Let the caller write directly into the buffer given by libfuse instead of returning
+        # a bytes object, which would have to be copied once more with memmove.
+        view = _memoryview_at(ctypes.addressof(buf.contents), size)
+        try:
+            retsize = self._ops.readinto(self._decode_optional_path(path), view, offset, fh)
+        finally:
+            view.release()
+
+        if not retsize:
+            return 0
+
+        assert retsize <= size, f'actual amount read {retsize} greater than expected {size}'
+        return retsize
+
     def write(self, path, buf, size, offset, fip):
-        data = ctypes.string_at(buf, size)
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('write', self._decode_optional_path(path), data, offset, fh)
+        if not self.write_memoryview:
+            data = ctypes.string_at(buf, size)
+            return self._ops.write(self._decode_optional_path(path), data, offset, fh)
+
+        data = _memoryview_at(ctypes.addressof(buf.contents), size).toreadonly()
+        try:
+            return self._ops.write(self._decode_optional_path(path), data, offset, fh)
+        finally:
+            data.release()
 
     def statfs(self, path, buf):
         stv = buf.contents
-        attrs = self.operations('statfs', path.decode(self.encoding))
+        attrs = self._ops.statfs(self._decode_path(path))
+        if isinstance(attrs, int):
+            return attrs
         for key, val in attrs.items():
             if hasattr(stv, key):
                 setattr(stv, key, val)
@@ -1245,24 +2412,25 @@ class FUSE():
 
     def flush(self, path, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('flush', self._decode_optional_path(path), fh)
+        return self._ops.flush(self._decode_optional_path(path), fh)
 
     def release(self, path, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('release', self._decode_optional_path(path), fh)
+        return self._ops.release(self._decode_optional_path(path), fh)
 
     def fsync(self, path, datasync, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('fsync', self._decode_optional_path(path), datasync, fh)
+        return self._ops.fsync(self._decode_optional_path(path), datasync, fh)
 
     def setxattr(self, path, name, value, size, options, *args):
-        return self.operations('setxattr', path.decode(self.encoding),
-                               name.decode(self.encoding),
-                               ctypes.string_at(value, size), options, *args)
+        return self._ops.setxattr(self._decode_path(path),
+                                  self._decode_path(name),
+                                  ctypes.string_at(value, size), options, *args)
 
     def getxattr(self, path, name, value, size, *args):
-        ret = self.operations('getxattr', path.decode(self.encoding),
-                                          name.decode(self.encoding), *args)
+        ret = self._ops.getxattr(self._decode_path(path), self._decode_path(name), *args)
+        if isinstance(ret, int):
+            return ret
 
         retsize = len(ret)
         # allow size queries
@@ -1280,10 +2448,12 @@ class FUSE():
         return retsize
 
     def listxattr(self, path, namebuf, size):
-        attrs = self.operations('listxattr', path.decode(self.encoding)) or ''
-        ret = '\x00'.join(attrs).encode(self.encoding)
+        attrs = self._ops.listxattr(self._decode_path(path)) or ()
+        if isinstance(attrs, int):
+            return attrs
+        ret = b'\x00'.join(self._encode_path(attr) for attr in attrs)
         if len(ret) > 0:
-            ret += '\x00'.encode(self.encoding)
+            ret += b'\x00'
 
         retsize = len(ret)
         # allow size queries
@@ -1300,12 +2470,14 @@ class FUSE():
         return retsize
 
     def removexattr(self, path, name):
-        return self.operations('removexattr', path.decode(self.encoding),
-                                              name.decode(self.encoding))
+        return self._ops.removexattr(self._decode_path(path), self._decode_path(name))
 
     def opendir(self, path, fip):
         # Ignore raw_fi
-        fip.contents.fh = self.operations('opendir', path.decode(self.encoding))
+        fh = self._ops.opendir(self._decode_path(path))
+        if fh < 0:
+            return fh
+        fip.contents.fh = fh
         return 0
 
     # == About readdir and what should be returned ==
@@ -1369,26 +2541,84 @@ class FUSE():
     # fuse_entry_out entry_out in the fuse_direntplus struct. fuse_attr has 16 members.
     # https://github.com/torvalds/linux/blob/1934261d897467a924e2afd1181a74c1cbfa2c1d/include/uapi/linux/
     #     fuse.h#L263C1-L280C3
-    def _readdir(self, path, buf, filler, offset, fip):
+    #
+    # With FUSE_READDIR_PLUS, the attributes given to the filler are only used when FUSE_FILL_DIR_PLUS
+    # is also specified. They are then given to the kernel as if a lookup had been done for each entry,
+    # which saves one getattr call per entry, e.g., for ls -l. In this case, the full stat is filled.
+    #
+    # == About the readdir offset ==
+    #
+    # If the filler is called with non-zero offsets, then libfuse only requests as many entries as fit into
+    # the buffer for one kernel request and calls readdir again with the offset of the last added entry
+    # to get the next page. It is the responsibility of readdir to resume at that offset. If all offsets
+    # are zero, then libfuse calls readdir only once, buffers all entries, and serves pages from that.
+    # For huge directories, readdir_from together with ReaddirCursor avoids both iterating all entries
+    # for each page and buffering all entries.
+    def _readdir(self, path, buf, filler, offset, fip, flags=0):
         # Ignore raw_fi
-        for item in self.operations('readdir', self._decode_optional_path(path), fip.contents.fh):
-            if isinstance(item, str):
-                name, st, offset = item, None, 0
+        if self._use_readdir_from:
+            items = self._ops.readdir_from(self._decode_optional_path(path), fip.contents.fh, offset)
+            skip = 0
+        else:
+            items = self._ops.readdir(self._decode_optional_path(path), fip.contents.fh)
+            skip = offset
+        if isinstance(items, int):
+            return items
+
+        plus = flags & FUSE_READDIR_PLUS
+        encode = self._encode_path
+        # The filler copies the given stat struct, so a single instance can be reused for all entries.
+        # Calling the filler with a plain address for the stat struct is measurably faster than with a pointer.
+        # Entries that only set st_mode rely on all other members being zero, e.g., st_ino, which libfuse
+        # uses with use_ino, so the struct has to be cleared after it was fully filled for a plus entry.
+        filler = ctypes.cast(filler, _fuse_fill_dir_address_t)
+        st = c_stat()
+        st_p = ctypes.addressof(st)
+        st_size = ctypes.sizeof(c_stat)
+        st_filled = False
+        for item in items:
+            fill_flags = 0
+            if isinstance(item, (str, bytes)):
+                name, stp, offset = item, None, 0
             else:
                 name, attrs, offset = item
-                if attrs:
-                    st = c_stat()
+                # readdir does not know about the requested offset, so skip already returned entries.
+                if skip and offset <= skip:
+                    continue
+                if not attrs:
+                    stp = None
+                elif isinstance(attrs, int):
                     # ONLY THE MODE IS USED BY FUSE! The caller may skip everything else.
-                    if 'st_mode' in attrs:
-                        setattr(st, 'st_mode', attrs['st_mode'])
+                    if st_filled:
+                        ctypes.memset(st_p, 0, st_size)
+                        st_filled = False
+                    st.st_mode = attrs
+                    stp = st_p
+                elif plus:
+                    ctypes.memset(st_p, 0, st_size)
+                    _set_st_attrs_from_any(st, attrs, use_ns=self.use_ns)
+                    st_filled = True
+                    stp = st_p
+                    fill_flags = FUSE_FILL_DIR_PLUS
+                elif isinstance(attrs, c_stat):
+                    stp = ctypes.addressof(attrs)
                 else:
-                    st = None
-
+                    if st_filled:
+                        ctypes.memset(st_p, 0, st_size)
+                        st_filled = False
+                    if isinstance(attrs, os.stat_result):
+                        st.st_mode = attrs.st_mode
+                    else:
+                        st.st_mode = attrs.get('st_mode', 0)
+                    stp = st_p
+
+            if name.__class__ is not bytes:
+                name = encode(name)
             if fuse_version_major == 2:
-                if filler(buf, name.encode(self.encoding), st, offset) != 0:
+                if filler(buf, name, stp, offset) != 0:
                     break
             elif fuse_version_major == 3:
-                if filler(buf, name.encode(self.encoding), st, offset, 0) != 0:
+                if filler(buf, name, stp, offset, fill_flags) != 0:
                     break
 
         return 0
@@ -1398,26 +2628,41 @@ class FUSE():
             return self._readdir(path, buf, filler, offset, fip)
     elif fuse_version_major == 3:
         def readdir(self, path, buf, filler, offset, fip, flags):
-            # TODO if bit 0 (FUSE_READDIR_PLUS) is set in flags, then we might want to gather more metadata
-            #      and return it in "filler" with bit 1 (FUSE_FILL_DIR_PLUS) being set.
             # Ignore raw_fi
-            return self._readdir(path, buf, filler, offset, fip)
+            return self._readdir(path, buf, filler, offset, fip, flags)
 
     def releasedir(self, path, fip):
         # Ignore raw_fi
-        return self.operations('releasedir', self._decode_optional_path(path), fip.contents.fh)
+        return self._ops.releasedir(self._decode_optional_path(path), fip.contents.fh)
 
     def fsyncdir(self, path, datasync, fip):
         # Ignore raw_fi
-        return self.operations('fsyncdir', self._decode_optional_path(path),
-                                           datasync, fip.contents.fh)
+        return self._ops.fsyncdir(self._decode_optional_path(path), datasync, fip.contents.fh)
     def _init(self, conn, config):
+        self._fuse_ptr = _libfuse.fuse_get_context().contents.fuse
+        # Start threads only in init because fuse_main_real might have forked into the background.
+        if self._metrics_file:
+            self._metrics.start_dump(self._metrics_file, self._metrics_interval)
+        if self.tuning is not None:
+            self.tuning.apply(conn.contents, config.contents if fuse_version_major == 3 else None)
+        if self._want_writeback_cache and fuse_version_major == 3:
+            if conn.contents.capable & FUSE_CAP_WRITEBACK_CACHE:
+                conn.contents.want |= FUSE_CAP_WRITEBACK_CACHE
+            else:
+                log.warning("The writeback cache is not supported by the kernel and will not be enabled.")
+
         if hasattr(
             self.operations, "init_with_config"
         ) and not getattr(self.operations.init_with_config, "libfuse_ignore", False):
             self.operations.init_with_config(conn, config)
         else:
-            self.operations("init", "/")
+            self._ops.init(self._decode_path(b"/"))
+
+        if self.tuning is not None:
+            _log_connection_info(conn.contents, config.contents if fuse_version_major == 3 else None)
+
+        # The capability might also have been requested by the tuning settings or by init_with_config.
+        self.writeback_cache = fuse_version_major == 3 and bool(conn.contents.want & FUSE_CAP_WRITEBACK_CACHE)
 
     if fuse_version_major == 2:
         def init(self, conn):
@@ -1427,40 +2672,82 @@ class FUSE():
             self._init(conn, config)
 
     def destroy(self, private_data):
-        return self.operations('destroy', '/')
+        return self._ops.destroy(self._decode_path(b'/'))
+
+    def _mounted_fuse(self):
+        if fuse_version_major != 3:
+            raise FuseOSError(errno.ENOSYS)
+        fuse_ptr = self._fuse_ptr
+        if not fuse_ptr:
+            raise FuseOSError(errno.ENOTCONN)
+        return fuse_ptr
+
+    @staticmethod
+    def _notify_result(ret):
+        if ret == -errno.ENOENT:
+            return False
+        if ret < 0:
+            raise FuseOSError(-ret)
+        return True
+
+    def invalidate_path(self, path):
+        '''
+        Tells the kernel to drop the cached attributes, data, and directory entry of the given path,
+        e.g., after it has been changed without going through the mount point. Returns False if the
+        kernel had nothing cached. Requires libfuse 3.
+
+        FUSE blocks while mounted, so call this via the fuse attribute of the operations object.
+        It can be called from any thread while mounted, but should not be called from an operation
+        handling the same path, because the kernel might wait for that operation to finish.
+
+        The low-level inode notifications are not offered because the high-level libfuse API does
+        not expose the node IDs it assigns to paths.
+        '''
+        if not hasattr(_libfuse, 'fuse_invalidate_path'):
+            raise FuseOSError(errno.ENOSYS)
+        return self._notify_result(_libfuse.fuse_invalidate_path(self._mounted_fuse(), self._encode_path(path)))
 
     def access(self, path, amode):
-        return self.operations('access', path.decode(self.encoding), amode)
+        return self._ops.access(self._decode_path(path), amode)
 
     def create(self, path, mode, fip):
         fi = fip.contents
-        path = path.decode(self.encoding)
+        path = self._decode_path(path)
+        if self.writeback_cache:
+            fi.flags = _writeback_cache_open_flags(fi.flags)
 
         if self.raw_fi:
-            return self.operations('create', path, mode, fi)
-        fi.fh = self.operations('create', path, mode, fi.flags)
+            return self._ops.create(path, mode, fi)
+        fh = self._ops.create(path, mode, fi.flags)
+        if fh < 0:
+            return fh
+        fi.fh = fh
         return 0
 
     def ftruncate(self, path, length, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('truncate', self._decode_optional_path(path), length, fh)
+        return self._ops.truncate(self._decode_optional_path(path), length, fh)
 
     def fgetattr(self, path, buf, fip):
         ctypes.memset(buf, 0, ctypes.sizeof(c_stat))
 
-        st = buf.contents
         if fip:
             fh = fip.contents if self.raw_fi else fip.contents.fh
         else:
             fh = fip
 
-        attrs = self.operations('getattr', self._decode_optional_path(path), fh)
-        set_st_attrs(st, attrs, use_ns=self.use_ns)
+        if self._use_getattr_into:
+            return self._ops.getattr_into(self._decode_optional_path(path), buf.contents, fh)
+
+        attrs = self._ops.getattr(self._decode_optional_path(path), fh)
+        if isinstance(attrs, int):
+            return attrs
+        _set_st_attrs_from_any(buf.contents, attrs, use_ns=self.use_ns)
         return 0
 
     def lock(self, path, fip, cmd, lock):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('lock', self._decode_optional_path(path), fh, cmd, lock)
+        return self._ops.lock(self._decode_optional_path(path), fh, cmd, lock)
 
     def _utimens(self, path, buf):
         if buf:
@@ -1470,40 +2757,77 @@ class FUSE():
         else:
             times = None
 
-        return self.operations('utimens', path.decode(self.encoding), times)
+        return self._ops.utimens(self._decode_path(path), times)
 
     if fuse_version_major == 2:
         utimens = _utimens
     elif fuse_version_major == 3:
         def utimens(self, path, buf, fip):
-            self._utimens(path, buf)
+            return self._utimens(path, buf)
 
     def bmap(self, path, blocksize, idx):
-        return self.operations('bmap', path.decode(self.encoding), blocksize, idx)
+        return self._ops.bmap(self._decode_path(path), blocksize, idx)
 
     def ioctl(self, path, cmd, arg, fip, flags, data):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('ioctl', path.decode(self.encoding), cmd, arg, fh, flags, data)
+        return self._ops.ioctl(self._decode_path(path), cmd, arg, fh, flags, data)
 
     def poll(self, path, fip, ph, reventsp):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('poll', path.decode(self.encoding), fh, ph, reventsp)
+        return self._ops.poll(self._decode_path(path), fh, PollHandle(ph) if ph else None, reventsp)
 
     def write_buf(self, path, buf, offset, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('write_buf', path.decode(self.encoding), buf, offset, fh)
+        return self._ops.write_buf(self._decode_optional_path(path),
+                                   BufferVector(buf.contents), offset, fh)
 
     def read_buf(self, path, bufpp, size, offset, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('read_buf', path.decode(self.encoding), bufpp, size, offset, fh)
+        buffers = self._ops.read_buf(self._decode_optional_path(path), size, offset, fh)
+        if isinstance(buffers, int):
+            return buffers
+        bufpp[0] = _new_fuse_bufvec(buffers, size)
+        return 0
 
     def flock(self, path, fip, op):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('flock', path.decode(self.encoding), fh, op)
+        return self._ops.flock(self._decode_path(path), fh, op)
 
     def fallocate(self, path, mode, offset, size, fip):
         fh = fip.contents if self.raw_fi else fip.contents.fh
-        return self.operations('fallocate', path.decode(self.encoding), mode, offset, size, fh)
+        return self._ops.fallocate(self._decode_path(path), mode, offset, size, fh)
+
+    def copy_file_range(self, path_in, fip_in, off_in, path_out, fip_out, off_out, size, flags):
+        if self.raw_fi:
+            fh_in, fh_out = fip_in.contents, fip_out.contents
+        else:
+            fh_in, fh_out = fip_in.contents.fh, fip_out.contents.fh
+        return self._ops.copy_file_range(
+            self._decode_optional_path(path_in), fh_in, off_in,
+            self._decode_optional_path(path_out), fh_out, off_out, size, flags)
+
+    def lseek(self, path, offset, whence, fip):
+        fh = fip.contents if self.raw_fi else fip.contents.fh
+        return self._ops.lseek(self._decode_optional_path(path), offset, whence, fh)
+
+
+def _writeback_cache_open_flags(flags):
+    # With the writeback cache, the kernel may read from files opened write-only to fill partially
+    # written pages, and it handles O_APPEND itself by sending writes with the offset at its cached
+    # end of file. Same as in libfuse's passthrough examples.
+    if flags & os.O_ACCMODE == os.O_WRONLY:
+        flags = (flags & ~os.O_ACCMODE) | os.O_RDWR
+    return flags & ~os.O_APPEND
+
+
+def _identity(value):
+    return value
+
+
+def _is_implemented(operations, name):
+    'Returns True if the operation exists and is not marked with _nullable_dummy_function.'
+    method = getattr(operations, name, None)
+    return method is not None and not getattr(method, 'libfuse_ignore', False)
 
 
 def _nullable_dummy_function(method):
@@ -1521,7 +2845,10 @@ class Operations:
     '''
     This class should be subclassed and passed as an argument to FUSE on
     initialization. All operations should raise a FuseOSError exception on
-    error.
+    error. Alternatively, operations may return a negative errno, e.g.,
+    -errno.ENOENT, which is passed through to libfuse as is. This avoids the
+    overhead of raising and handling an exception for frequent errors such as
+    ENOENT from getattr.
 
     When in doubt of what an operation should do, check the FUSE header file
     or the corresponding system call man page.
@@ -1534,8 +2861,13 @@ class Operations:
     This has the side effect that trace debug output, enabled with -o debug,
     for these FUSE function will not be printed. To enable the debug output,
     it should be overwritten with a method simply raising FuseOSError(errno.ENOSYS).
+
+    While mounted, the fuse attribute is the running FUSE instance, e.g., for
+    calling invalidate_path or stats from the operations or other threads.
     '''
 
+    fuse = None
+
     def __call__(self, op, *args):
         if not hasattr(self, op):
             raise FuseOSError(errno.EFAULT)
@@ -1599,6 +2931,10 @@ class Operations:
 
         st_atime, st_mtime and st_ctime should be floats.
 
+        Instead of a dictionary, an os.stat_result or a c_stat may also be
+        returned. Both are copied without the overhead of iterating over the
+        dictionary, e.g., return os.lstat(path) for passthrough filesystems.
+
         NOTE: There is an incompatibility between Linux and Mac OS X
         concerning st_nlink of directories. Mac OS X counts all files inside
         the directory, while Linux counts only the subdirectories.
@@ -1608,6 +2944,16 @@ class Operations:
             raise FuseOSError(errno.ENOENT)
         return {'st_mode': (S_IFDIR | 0o755), 'st_nlink': 2}
 
+    @_nullable_dummy_function
+    def getattr_into(self, path, st, fh=None):
+        '''
+        Alternative to getattr, which will be used instead if implemented.
+        st is the zero-initialized c_stat given by libfuse, which should be
+        filled in place. Returns 0 or a negative errno.
+        '''
+
+        raise FuseOSError(errno.ENOSYS)
+
     @_nullable_dummy_function
     def getxattr(self, path, name, position=0):
         raise FuseOSError(ENOTSUP)
@@ -1665,6 +3011,27 @@ class Operations:
             open(self, path, fi)
 
         and the file handle should be set directly.
+
+        When the property "writeback_cache" is set to True in the operations
+        class, FUSE requests the writeback cache from the kernel (FUSE 3 only).
+        The kernel then caches writes and sends them merged into larger
+        requests. If it has been granted, the writeback_cache attribute of the
+        FUSE object is True and the following applies to the file system:
+
+         - open and create will be called with O_WRONLY replaced by O_RDWR
+           because the kernel may need to read from files opened write-only
+           to fill partially written pages. Reading must therefore succeed.
+         - O_APPEND is removed from the flags because the kernel handles it
+           itself. write is called with the offset at the end of the file as
+           known to the kernel, which must be honored as is. Appends are not
+           atomic in the presence of modifications bypassing the mount point.
+         - The kernel uses its own file size and modification time for
+           cached files instead of the ones returned by getattr. Files must
+           not be modified bypassing the mount point, else cached data will
+           be stale or overwritten.
+         - Writes may be sent after the writing process has exited and from
+           a different context. fuse_get_context does not identify the
+           writing process and write should not check permissions.
         '''
 
         return 0
@@ -1681,15 +3048,50 @@ class Operations:
 
         raise FuseOSError(errno.EIO)
 
+    @_nullable_dummy_function
+    def readinto(self, path, buf, offset, fh):
+        '''
+        Zero-copy alternative to read. If implemented, it is used instead of read.
+
+        buf is a writable memoryview of exactly the requested size, which points
+        directly into the buffer given by libfuse. It is only valid for the
+        duration of the call. Returns the number of bytes written into buf.
+        '''
+
+        raise FuseOSError(errno.EIO)
+
     @_nullable_dummy_function
     def readdir(self, path, fh):
         '''
         Can return either a list of names, or a list of (name, attrs, offset)
-        tuples. attrs is a dict as in getattr.
+        tuples. attrs is a dict, os.stat_result, or c_stat as in getattr.
+        For large directories, the fastest format is (name, st_mode, offset)
+        with an integer st_mode and, if possible, with name given as bytes,
+        which avoids any per-entry allocations besides the tuple itself.
+
+        Only st_mode is used, unless the kernel requested readdirplus with
+        FUSE 3. Then, all attributes are forwarded to the kernel, which avoids
+        subsequent getattr calls for each entry, e.g., for ls -l.
         '''
 
         return ['.', '..']
 
+    @_nullable_dummy_function
+    def readdir_from(self, path, fh, offset):
+        '''
+        Alternative to readdir, which will be used instead if implemented.
+        Returns (name, attrs, next_offset) tuples for the entries starting
+        at the given offset. next_offset must be non-zero and is the offset
+        at which a subsequent call should resume after this entry.
+
+        libfuse only requests as many entries as fit into one kernel request
+        per call. Therefore, huge directories can be streamed with O(1) work
+        per entry by creating a ReaddirCursor in opendir, returning
+        cursor.entries_from(offset) here, and dropping it in releasedir.
+        '''
+
+        raise FuseOSError(errno.ENOSYS)
+
     @_nullable_dummy_function
     def readlink(self, path):
         raise FuseOSError(errno.ENOENT)
@@ -1752,18 +3154,47 @@ class Operations:
 
     @_nullable_dummy_function
     def write(self, path, data, offset, fh):
+        '''
+        Returns the number of bytes written.
+
+        When the property "write_memoryview" is set to True in the operations
+        class, data is a read-only memoryview pointing directly to the buffer
+        given by libfuse instead of a copy as bytes object. It is only valid
+        for the duration of the call and must be copied if it is to be kept.
+        '''
+
         raise FuseOSError(errno.EROFS)
 
     @_nullable_dummy_function
     def poll(self, path, fh, ph, reventsp):
+        '''
+        Stores the events the file is ready for in reventsp[0], e.g., with set_revents.
+        ph is None or a PollHandle, which should be kept to call its notify method once
+        the file becomes ready. Else, clients have to poll repeatedly.
+        '''
+
         raise FuseOSError(errno.ENOSYS)
 
     @_nullable_dummy_function
     def write_buf(self, path, buf, offset, fh):
+        '''
+        Alternative to write, which will be used instead if implemented. buf is a BufferVector,
+        which may contain a pipe file descriptor when libfuse uses splice. Use buf.copy_to_fd to
+        move the data to a file descriptor without copying it through Python.
+        Returns the number of bytes written.
+        '''
+
         raise FuseOSError(errno.ENOSYS)
 
     @_nullable_dummy_function
-    def read_buf(self, path, bufpp, size, offset, fh):
+    def read_buf(self, path, size, offset, fh):
+        '''
+        Alternative to read, which will be used instead if implemented. Returns a bytes-like
+        object, a FdBuffer, or a list thereof, with at most size bytes in total. Returning
+        FdBuffer(fd, size, pos=offset) lets libfuse read, or even splice, the data directly from
+        the given file descriptor to the kernel without it passing through Python.
+        '''
+
         raise FuseOSError(errno.ENOSYS)
 
     @_nullable_dummy_function
@@ -1774,6 +3205,163 @@ class Operations:
     def fallocate(self, path, mode, offset, size, fh):
         raise FuseOSError(errno.ENOSYS)
 
+    @_nullable_dummy_function
+    def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+        '''
+        Copies up to size bytes from the opened file path_in at off_in to the opened file
+        path_out at off_out and returns the number of bytes copied. This is only supported
+        with FUSE 3. Implementing it lets the backend do the copy itself, for example with
+        os.copy_file_range on the underlying files or with a server-side copy, instead of the
+        kernel falling back to reading and writing all data through userspace.
+        '''
+
+        raise FuseOSError(errno.ENOSYS)
+
+    @_nullable_dummy_function
+    def lseek(self, path, offset, whence, fh):
+        '''
+        Returns the offset of the next data (whence is os.SEEK_DATA) or of the next hole
+        (whence is os.SEEK_HOLE) at or after offset. This is only supported with FUSE 3. The
+        kernel only forwards these two whence values, and without this operation, it treats
+        files as containing no holes, i.e., the whole file is data followed by the implicit
+        hole at the end of the file. Raise FuseOSError(errno.ENXIO) if offset is at or beyond
+        the end of the file.
+        '''
+
+        raise FuseOSError(errno.ENOSYS)
+
+
+class AsyncOperations(Operations):
+    '''
+    Base class for file systems implementing operations as coroutines, i.e.,
+    with "async def". Synchronous operations can be mixed with them and are
+    called directly in the libfuse worker thread as usual.
+
+    Coroutine operations are scheduled on an asyncio event loop running in a
+    dedicated thread, and the libfuse worker thread only blocks until the
+    result is available. This way, many concurrent requests can wait on I/O
+    in the same event loop. The loop is started on first use and stopped by
+    FUSE after unmounting. To use an existing loop running in another thread
+    instead, assign it to the event_loop attribute.
+
+    If the file system is mounted with the "intr" option, the coroutine of
+    an interrupted request is cancelled and the request fails with EINTR.
+    '''
+
+    event_loop = None
+    interrupt_poll_interval = 0.1  # seconds between checks for interrupted requests
+
+    _event_loop_thread = None
+    _event_loop_lock = threading.Lock()
+
+    def __call__(self, op, *args):
+        result = super().__call__(op, *args)
+        if _is_awaitable(result):
+            return self.run_coroutine(result)
+        return result
+
+    def run_coroutine(self, coroutine):
+        'Runs the coroutine, or any other awaitable, in the event loop and returns its result.'
+        # Imported here because asyncio alone takes longer to import than this module.
+        import asyncio
+        import concurrent.futures
+
+        if not asyncio.iscoroutine(coroutine):
+            coroutine = _await(coroutine)
+        loop = self.event_loop or self._start_event_loop()
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        while True:
+            done, _ = concurrent.futures.wait((future,), timeout=self.interrupt_poll_interval)
+            if done:
+                return future.result()
+            if fuse_interrupted():
+                future.cancel()
+                raise FuseOSError(errno.EINTR)
+
+    def _start_event_loop(self):
+        with self._event_loop_lock:
+            if self.event_loop is None:
+                import asyncio
+
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='fuse-event-loop', daemon=True)
+                thread.start()
+                self.event_loop, self._event_loop_thread = loop, thread
+            return self.event_loop
+
+    def close_event_loop(self):
+        'Stops the event loop if it was started by run_coroutine.'
+        with self._event_loop_lock:
+            loop, thread = self.event_loop, self._event_loop_thread
+            if thread is None:
+                return
+            self.event_loop = self._event_loop_thread = None
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+class ReaddirCursor:
+    '''
+    Resumable directory iterator for use with Operations.readdir_from.
+
+    entries_factory is a callable returning an iterable of names or of
+    (name, attrs) tuples. It is only called again if the listing is rewound.
+    Entries are numbered so that resuming at the offset of the next entry,
+    which is the common case, simply continues the iteration.
+    '''
+
+    def __init__(self, entries_factory):
+        self._entries_factory = entries_factory
+        self._iterator = None
+        self._index = 0    # offset of the next entry to be read from the iterator
+        self._last = None  # last returned entry, which might not have fit into the buffer anymore
+
+    def entries_from(self, offset):
+        'Yields (name, attrs, next_offset) tuples starting at the given offset.'
+        resumable = self._iterator is not None and (
+            offset == self._index or (offset == self._index - 1 and self._last is not None))
+        if not resumable:
+            self._iterator = iter(self._entries_factory())
+            self._index = 0
+            self._last = None
+            for _ in range(offset):
+                if next(self._iterator, None) is None:
+                    break
+                self._index += 1
+
+        if offset < self._index:
+            yield self._last
+
+        for entry in self._iterator:
+            self._index += 1
+            if isinstance(entry, (str, bytes)):
+                self._last = (entry, None, self._index)
+            else:
+                self._last = (entry[0], entry[1], self._index)
+            yield self._last
+
+
+class BytesOperations(Operations):
+    '''
+    Operations base class for use with path_type bytes. All paths and names
+    are given as bytes and are expected to be returned as bytes.
+    This avoids decoding and encoding them on each call.
+    '''
+
+    path_type = bytes
+
+    def getattr(self, path, fh=None):
+        if path != b'/':
+            raise FuseOSError(errno.ENOENT)
+        return {'st_mode': (S_IFDIR | 0o755), 'st_nlink': 2}
+
+    @_nullable_dummy_function
+    def readdir(self, path, fh):
+        return [b'.', b'..']
+
 
 class LoggingMixIn:
     log = logging.getLogger('fuse.log-mixin')
@@ -1789,3 +3377,697 @@ class LoggingMixIn:
             raise
         finally:
             self.log.debug('<- %s %s', op, repr(ret))
+
+
+class _TTLCache:
+    '''
+    A thread-safe, size-bounded LRU cache whose entries expire after ttl seconds.
+    Values are computed between reserve and complete, and invalidations of a key
+    in the meantime prevent the possibly outdated value from being stored.
+    '''
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Maps keys whose values are being computed to [number of computations, invalidations].
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def reserve(self, key):
+        'Registers a computation of the value for key and returns the token to pass to complete.'
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = [0, 0]
+            pending[0] += 1
+            return pending[1]
+
+    def complete(self, key, token, value, now):
+        '''
+        Ends the computation started by reserve and inserts the value unless it is None or
+        the key has been invalidated since.
+        '''
+        with self._lock:
+            pending = self._pending[key]
+            pending[0] -= 1
+            if not pending[0]:
+                del self._pending[key]
+            if value is not None and pending[1] == token:
+                self._insert(key, value, now)
+
+    def _insert(self, key, value, now):
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _invalidate_pending(self, keys):
+        for key in keys:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending[1] += 1
+
+    def discard(self, *keys):
+        with self._lock:
+            self._invalidate_pending(keys)
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def discard_tree(self, key):
+        'Discards the given key and all keys that are paths below it.'
+        prefix = key + (b'/' if isinstance(key, bytes) else '/')
+        with self._lock:
+            self._invalidate_pending([key] + [path for path in self._pending if path.startswith(prefix)])
+            self._entries.pop(key, None)
+            for path in [path for path in self._entries if path.startswith(prefix)]:
+                del self._entries[path]
+
+    def clear(self):
+        with self._lock:
+            self._invalidate_pending(self._pending)
+            self._entries.clear()
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl}
+
+
+_caching_mixin_lock = threading.Lock()
+
+
+class CachingMixIn:
+    '''
+    Caches getattr results per path for getattr_cache_ttl seconds and for at
+    most getattr_cache_maxsize paths, evicting the least recently used ones.
+    This helps for slow backends because libfuse also calls getattr for open
+    files and after the kernel's entry_timeout has expired.
+
+    Cached entries are invalidated by all operations that modify a file or a
+    directory's entries. Changes that bypass this filesystem are only noticed
+    after the TTL has expired.
+
+    Like LoggingMixIn, it should come before Operations in the list of base
+    classes and it can be combined with LoggingMixIn. It does not cache
+    getattr_into.
+    '''
+
+    getattr_cache_ttl = 1.0
+    getattr_cache_maxsize = 65536
+
+    _invalidating_operations = frozenset((
+        'chmod', 'chown', 'copy_file_range', 'create', 'fallocate', 'link', 'mkdir', 'mknod',
+        'rename', 'rmdir', 'symlink', 'truncate', 'unlink', 'utimens', 'write', 'write_buf',
+    ))
+    # These change the link count and times of the parent directory as well.
+    _namespace_operations = frozenset((
+        'create', 'link', 'mkdir', 'mknod', 'rename', 'rmdir', 'symlink', 'unlink',
+    ))
+
+    @property
+    def getattr_cache(self):
+        cache = self.__dict__.get('_getattr_cache')
+        if cache is None:
+            with _caching_mixin_lock:
+                cache = self.__dict__.get('_getattr_cache')
+                if cache is None:
+                    cache = _TTLCache(self.getattr_cache_ttl, self.getattr_cache_maxsize)
+                    self.__dict__['_getattr_cache'] = cache
+        return cache
+
+    def getattr_cache_info(self):
+        'Returns a dictionary with the hit and miss counters and the current size of the cache.'
+        return self.getattr_cache.info()
+
+    def invalidate_getattr_cache(self, path=None):
+        'Discards the cached attributes for the given path or for all paths if path is None.'
+        if path is None:
+            self.getattr_cache.clear()
+        else:
+            self.getattr_cache.discard(path)
+
+    def __call__(self, op, path, *args):
+        if op == 'getattr' and path is not None:
+            cache = self.getattr_cache
+            attrs = cache.get(path, time.monotonic())
+            if attrs is None:
+                # The result is not cached if the path is invalidated during the call.
+                token = cache.reserve(path)
+                try:
+                    attrs = super().__call__(op, path, *args)
+                finally:
+                    cache.complete(path, token, None if isinstance(attrs, int) else attrs, time.monotonic())
+            return attrs
+
+        if op not in self._invalidating_operations:
+            return super().__call__(op, path, *args)
+
+        try:
+            return super().__call__(op, path, *args)
+        finally:
+            self._invalidate_after(op, path, args)
+
+    def _invalidate_after(self, op, path, args):
+        cache = self.getattr_cache
+        paths = [path]
+        if op == 'rename':
+            # Renaming a directory changes the paths of all its descendants.
+            cache.discard_tree(path)
+            cache.discard_tree(args[0])
+            paths.append(args[0])
+        elif op == 'link':
+            # The link count of the source changes.
+            paths.append(args[0])
+        elif op == 'copy_file_range':
+            # Only the destination, path_out, is modified. It does not affect its parent.
+            paths = [args[2]]
+
+        if op in self._namespace_operations:
+            paths.extend([posixpath.dirname(p) for p in paths])
+        cache.discard(*paths)
+
+
+TraceRecord = namedtuple('TraceRecord', (
+    'operation', 'errno', 'path_hash', 'offset', 'size', 'start_ns', 'end_ns', 'thread_id'))
+
+
+class TraceBuffer:
+    '''
+    Ring buffer of fixed-size binary trace records, which keeps the latest capacity records.
+    Records are written without locking. Records written concurrently to dumping might be
+    inconsistent in the dump.
+    '''
+
+    magic = b'FUSETRC1'
+    record = struct.Struct('<HiIqQQQQ')  # see TraceRecord
+    _header = struct.Struct('<QI')  # number of records, size of the operation name table
+
+    def __init__(self, capacity=65536, sample_rate=1):
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self.operations = []
+        self._operation_ids = {}
+        self._lock = threading.Lock()
+        self._buffer = bytearray(capacity * self.record.size)
+        self._calls = itertools.count()
+        self._records = itertools.count()
+        self._count = 0
+
+    def operation_id(self, name):
+        op_id = self._operation_ids.get(name)
+        if op_id is None:
+            with self._lock:
+                op_id = self._operation_ids.get(name)
+                if op_id is None:
+                    op_id = len(self.operations)
+                    self.operations.append(name)
+                    self._operation_ids[name] = op_id
+        return op_id
+
+    def sample(self):
+        'Returns True for every sample_rate-th call.'
+        return self.sample_rate <= 1 or next(self._calls) % self.sample_rate == 0
+
+    def add(self, op_id, error, path_hash, offset, size, start_ns, end_ns, thread_id):
+        # next() on itertools.count is atomic, so each thread writes to a different slot.
+        index = next(self._records)
+        self.record.pack_into(self._buffer, (index % self.capacity) * self.record.size,
+                              op_id, error, path_hash, offset, size, start_ns, end_ns, thread_id)
+        self._count = max(self._count, index + 1)
+
+    def records(self):
+        'Returns the buffered records as list of TraceRecord, oldest first.'
+        return [TraceRecord(self.operations[fields[0]], *fields[1:])
+                for fields in self.record.iter_unpack(self._ordered_records())]
+
+    def _ordered_records(self):
+        data = bytes(self._buffer)
+        count = self._count
+        if count <= self.capacity:
+            return data[:count * self.record.size]
+        split = (count % self.capacity) * self.record.size
+        return data[split:] + data[:split]
+
+    def dump(self, path):
+        'Writes the buffered records to a compact binary file, which can be read with read_trace.'
+        records = self._ordered_records()
+        names = '\n'.join(self.operations).encode()
+        with open(path, 'wb') as file:
+            file.write(self.magic)
+            file.write(self._header.pack(len(records) // self.record.size, len(names)))
+            file.write(names)
+            file.write(records)
+
+
+def read_trace(path):
+    'Returns the list of TraceRecord from a file written by TraceBuffer.dump.'
+    with open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(TraceBuffer.magic):
+        raise ValueError(f"{path} is not a FUSE trace file.")
+    offset = len(TraceBuffer.magic)
+    count, names_size = TraceBuffer._header.unpack_from(data, offset)
+    offset += TraceBuffer._header.size
+    names = data[offset:offset + names_size].decode().split('\n')
+    offset += names_size
+    records = data[offset:offset + count * TraceBuffer.record.size]
+    return [TraceRecord(names[fields[0]], *fields[1:]) for fields in TraceBuffer.record.iter_unpack(records)]
+
+
+# Functions returning the (offset, size) tuple to be traced from the arguments after the path.
+_trace_extents = {
+    'read': lambda args: (args[1], args[0]),
+    'readinto': lambda args: (args[1], len(args[0])),
+    'read_buf': lambda args: (args[1], args[0]),
+    'write': lambda args: (args[1], len(args[0])),
+    'write_buf': lambda args: (args[1], len(args[0])),
+    'truncate': lambda args: (0, args[0]),
+    'fallocate': lambda args: (args[1], args[2]),
+    'copy_file_range': lambda args: (args[1], args[5]),
+    'lseek': lambda args: (args[0], 0),
+    'readdir_from': lambda args: (args[1], 0),
+}
+
+_tracing_mixin_lock = threading.Lock()
+
+
+class TracingMixIn:
+    '''
+    Low-overhead alternative to LoggingMixIn for use under load. Instead of
+    formatting log messages, each operation is recorded as a fixed-size
+    binary record into a ring buffer keeping the latest trace_capacity
+    records. A record contains the operation, the CRC32 of the path, the
+    offset and size for data operations, the errno, the start and end times
+    from time.perf_counter_ns, and the thread ID. Only every
+    trace_sample_rate-th operation is recorded.
+
+    Call dump_trace to write the buffered records to a file, which can be
+    read with read_trace. Like LoggingMixIn, it should come before
+    Operations in the list of base classes.
+    '''
+
+    trace_capacity = 65536
+    trace_sample_rate = 1
+
+    @property
+    def trace_buffer(self):
+        trace = self.__dict__.get('_trace_buffer')
+        if trace is None:
+            with _tracing_mixin_lock:
+                trace = self.__dict__.get('_trace_buffer')
+                if trace is None:
+                    trace = TraceBuffer(self.trace_capacity, self.trace_sample_rate)
+                    self.__dict__['_trace_buffer'] = trace
+        return trace
+
+    def dump_trace(self, path):
+        'Writes the buffered trace records to the given file.'
+        self.trace_buffer.dump(path)
+
+    def __call__(self, op, path, *args):
+        trace = self.trace_buffer
+        if not trace.sample():
+            return super().__call__(op, path, *args)
+
+        error = 0
+        start = time.perf_counter_ns()
+        try:
+            result = super().__call__(op, path, *args)
+            if result.__class__ is int and result < 0:
+                error = -result
+            return result
+        except OSError as e:
+            error = e.errno if isinstance(e.errno, int) else errno.EINVAL
+            raise
+        except BaseException:
+            error = errno.EINVAL
+            raise
+        finally:
+            end = time.perf_counter_ns()
+            extent = _trace_extents.get(op)
+            offset, size = extent(args) if extent is not None else (0, 0)
+            if path.__class__ is str:
+                path_hash = crc32(path.encode('utf-8', 'surrogateescape'))
+            else:
+                path_hash = crc32(path) if path else 0
+            trace.add(trace.operation_id(op), error, path_hash, offset, size, start, end,
+                      threading.get_ident())
+
+
+# Indices of file handle arguments, counting the path as first argument, used for replaying.
+_fh_argument_indices = {
+    'copy_file_range': (1, 4),
+    'fallocate': (4,),
+    'flock': (1,),
+    'flush': (1,),
+    'fsync': (2,),
+    'fsyncdir': (2,),
+    'getattr': (1,),
+    'getattr_into': (2,),
+    'ioctl': (3,),
+    'lock': (1,),
+    'lseek': (3,),
+    'poll': (1,),
+    'read': (3,),
+    'read_buf': (3,),
+    'readdir': (1,),
+    'readdir_from': (1,),
+    'readinto': (3,),
+    'release': (1,),
+    'releasedir': (1,),
+    'truncate': (2,),
+    'write': (3,),
+    'write_buf': (3,),
+}
+# Arguments only recorded by their size, counting the path as first argument.
+_payload_argument_indices = {'readinto': 1, 'write': 1, 'write_buf': 1}
+# Untyped pointer arguments, which arrive as plain integers, counting the path as first argument.
+# They are recorded as unreplayable objects because the addresses are meaningless in another process.
+_pointer_argument_indices = {'ioctl': (2, 5)}
+# Operations returning a file handle, whose recorded value is mapped to the replayed one.
+_fh_returning_operations = ('create', 'open', 'opendir')
+
+
+class OperationRecorder:
+    '''
+    Records calls to operations with their arguments, start times, and thread IDs as JSON lines.
+    Used by FUSE when given a record_file.
+    '''
+
+    def __init__(self, path):
+        import json
+
+        self._dumps = json.dumps
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write(self._dumps({'format': 'fusepy-recording', 'version': 1}) + '\n')
+        self._lock = threading.Lock()
+        self._start = time.perf_counter_ns()
+
+    @staticmethod
+    def _encode(value, payload=False):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, (bytes, bytearray, memoryview, BufferVector)):
+            if payload:
+                return {'size': len(value)}
+            return {'bytes': bytes(value).decode('latin-1')}
+        if isinstance(value, (tuple, list)):
+            return [OperationRecorder._encode(element) for element in value]
+        return {'object': type(value).__name__}
+
+    def wrap(self, name, method):
+        payload_index = _payload_argument_indices.get(name)
+        pointer_indices = _pointer_argument_indices.get(name, ())
+        returns_fh = name in _fh_returning_operations
+
+        def record(*args):
+            start = time.perf_counter_ns() - self._start
+            result = None
+            try:
+                result = method(*args)
+                return result
+            finally:
+                entry = {
+                    't': start,
+                    'thread': threading.get_ident(),
+                    'op': name,
+                    'args': [{'object': 'pointer'} if index in pointer_indices else
+                             self._encode(arg, index == payload_index) for index, arg in enumerate(args)],
+                }
+                if returns_fh and isinstance(result, int):
+                    entry['result'] = result
+                line = self._dumps(entry) + '\n'
+                with self._lock:
+                    if not self._file.closed:
+                        self._file.write(line)
+
+        return record
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _decode_recorded_argument(value):
+    if isinstance(value, list):
+        return tuple(_decode_recorded_argument(element) for element in value)
+    if isinstance(value, dict):
+        if 'size' in value:
+            return bytearray(value['size'])
+        if 'bytes' in value:
+            return value['bytes'].encode('latin-1')
+        if value.get('object') == 'c_stat':
+            return c_stat()
+        raise TypeError(f"Cannot replay an argument of type {value.get('object')}.")
+    return value
+
+
+def _new_memory_buffer_vector(size):
+    'Returns a BufferVector over a single zero-filled memory buffer of the given size.'
+    data = ctypes.create_string_buffer(size)
+    bufv = fuse_bufvec(count=1)
+    bufv.buf[0].size = size
+    bufv.buf[0].mem = ctypes.addressof(data)
+    buffer_vector = BufferVector(bufv)
+    buffer_vector.data = data  # keeps the memory alive for as long as the BufferVector is
+    return buffer_vector
+
+
+def replay_recording(operations, path, threads=1, realtime=False):
+    '''
+    Calls the operations recorded with FUSE(..., record_file=path) on the given operations object
+    without mounting and returns a dictionary with the number of replayed, skipped, and failed
+    operations, the duration, the throughput in operations per second, and latency percentiles in
+    seconds, overall and per operation.
+
+    The operations are distributed over the given number of threads in recorded order. If
+    realtime is True, each operation is started at its recorded time relative to the first
+    one, else as fast as possible. Recorded file handles are mapped to the ones returned by
+    the replayed open, create, and opendir calls. Operations with arguments that cannot be
+    reconstructed, i.e., pointers such as the arg and data of ioctl, the reventsp and poll
+    handle of poll, or the flock struct of lock, are skipped, as are operations on file
+    handles whose replayed open, create, or opendir call failed. Written data is replaced
+    by zeros of the recorded size.
+    '''
+    import json
+    from collections import deque
+
+    with open(path, encoding='utf-8') as file:
+        header = json.loads(file.readline())
+        if header.get('format') != 'fusepy-recording':
+            raise ValueError(f"{path} is not a recording of FUSE operations.")
+        entries = [json.loads(line) for line in file]
+    entries.sort(key=lambda entry: entry['t'])
+    recorded_handles = {entry['result'] for entry in entries if 'result' in entry}
+
+    dispatcher = _OperationsDispatcher(operations)
+    fh_map = {}
+    failed_handles = set()
+    fh_map_changed = threading.Condition()
+    lock = threading.Lock()
+    latencies = {}
+    counts = {'replayed': 0, 'skipped': 0, 'errors': 0}
+    next_entry = itertools.count()
+
+    def map_fh(fh):
+        if fh not in recorded_handles:
+            return fh
+        with fh_map_changed:
+            # The open call for this file handle might still be running in another thread.
+            fh_map_changed.wait_for(lambda: fh in fh_map or fh in failed_handles, timeout=1.0)
+            if fh in failed_handles:
+                raise LookupError(f"The replayed call returning file handle {fh} failed.")
+            return fh_map.get(fh, fh)
+
+    def work():
+        while True:
+            index = next(next_entry)
+            if index >= len(entries):
+                return
+            entry = entries[index]
+            name = entry['op']
+            try:
+                args = [_decode_recorded_argument(arg) for arg in entry['args']]
+                if name == 'write_buf' and len(args) > 1 and isinstance(args[1], bytearray):
+                    args[1] = _new_memory_buffer_vector(len(args[1]))
+                for fh_index in _fh_argument_indices.get(name, ()):
+                    if fh_index < len(args):
+                        args[fh_index] = map_fh(args[fh_index])
+            except (TypeError, LookupError):
+                with lock:
+                    counts['skipped'] += 1
+                continue
+
+            if realtime:
+                delay = (entry['t'] - entries[0]['t']) / 1e9 - (time.perf_counter() - start_time)
+                if delay > 0:
+                    time.sleep(delay)
+
+            failed = False
+            start = time.perf_counter_ns()
+            try:
+                result = getattr(dispatcher, name)(*args)
+                if hasattr(result, '__next__'):
+                    deque(result, maxlen=0)
+                failed = isinstance(result, int) and result < 0
+            except Exception:  # pylint: disable=broad-exception-caught
+                result = None
+                failed = True
+            duration = time.perf_counter_ns() - start
+
+            if 'result' in entry:
+                with fh_map_changed:
+                    # Recorded handles can be reused after release, so a later call can succeed.
+                    if failed:
+                        fh_map.pop(entry['result'], None)
+                        failed_handles.add(entry['result'])
+                    else:
+                        fh_map[entry['result']] = result
+                        failed_handles.discard(entry['result'])
+                    fh_map_changed.notify_all()
+            with lock:
+                counts['replayed'] += 1
+                counts['errors'] += failed
+                latencies.setdefault(name, []).append(duration)
+
+    start_time = time.perf_counter()
+    workers = [threading.Thread(target=work, name=f'fuse-replay-{i}') for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start_time
+
+    def percentiles(values):
+        values = sorted(values)
+        quantiles = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p99.9', 0.999), ('max', 1.0))
+        return {key: values[min(len(values) - 1, int(len(values) * quantile))] / 1e9
+                for key, quantile in quantiles} if values else {}
+
+    return {
+        **counts,
+        'seconds': elapsed,
+        'operations_per_second': counts['replayed'] / elapsed if elapsed > 0 else 0.0,
+        'latency': percentiles([value for values in latencies.values() for value in values]),
+        'latency_per_operation': {name: percentiles(values) for name, values in sorted(latencies.items())},
+    }
+
+
+class FuseHarness(FUSE):
+    '''
+    Sets up the callbacks for the given operations exactly like FUSE but without mounting, so
+    that tests and benchmarks can call them directly in-process, e.g., without /dev/fuse. The
+    ctypes callbacks are the members of the fuse_operations attribute and can be called via
+    call with ctypes buffers, fuse_file_info pointers from file_info, and fillers from
+    new_filler. While the harness is open, fuse_get_context returns a context with the given
+    uid, gid, and pid. Use it as context manager or call close when done.
+
+    Harnesses may be nested and used from multiple threads. fuse_get_context is replaced
+    process-wide while any harness is open and returns the context of the most recently
+    opened one, which is restored when the last harness is closed.
+    '''
+
+    _open_contexts = []
+    _open_contexts_lock = threading.Lock()
+    _original_get_context = None
+
+    def __init__(self, operations, raw_fi=False, encoding='utf-8', path_type=None, tuning=None,
+                 metrics=False, record_file=None, uid=0, gid=0, pid=0, umask=0o022):
+        self._setup(operations, raw_fi=raw_fi, encoding=encoding, path_type=path_type, tuning=tuning,
+                    metrics=metrics, record_file=record_file)
+        try:
+            self.fuse_operations = self._make_fuse_operations()
+        except BaseException:
+            self._teardown()
+            raise
+
+        self.context = fuse_context(uid=uid, gid=gid, pid=pid, umask=umask)
+        self._context_pointer = ctypes.pointer(self.context)
+        cls = FuseHarness
+        with cls._open_contexts_lock:
+            if not cls._open_contexts:
+                cls._original_get_context = _libfuse.fuse_get_context
+                _libfuse.fuse_get_context = cls._get_context
+            cls._open_contexts.append(self._context_pointer)
+        self._closed = False
+
+    @staticmethod
+    def _get_context():
+        return FuseHarness._open_contexts[-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        cls = FuseHarness
+        with cls._open_contexts_lock:
+            if self._closed:
+                return
+            self._closed = True
+            # Remove by identity because closing does not have to happen in the order of opening.
+            for i, pointer in enumerate(cls._open_contexts):
+                if pointer is self._context_pointer:
+                    del cls._open_contexts[i]
+                    break
+            if not cls._open_contexts:
+                _libfuse.fuse_get_context = cls._original_get_context
+                cls._original_get_context = None
+        self._teardown()
+
+    def call(self, name, *args):
+        '''
+        Calls the callback for the given fuse_operations member and returns its result,
+        which is 0 or a negative errno for most operations.
+        '''
+        callback = getattr(self.fuse_operations, name)
+        if not callback:
+            raise AttributeError(f"The operation {name} is not implemented.")
+        result = callback(*args)
+        self._raise_critical_exception()
+        return result
+
+    def call_init(self, capable=0):
+        'Calls init with new fuse_conn_info and fuse_config structs, which are returned.'
+        conn = fuse_conn_info(capable=capable)
+        config = fuse_config()
+        if fuse_version_major == 2:
+            self.call('init', ctypes.byref(conn))
+        else:
+            self.call('init', ctypes.byref(conn), ctypes.byref(config))
+        return conn, config
+
+    @staticmethod
+    def file_info(fh=0, flags=0):
+        'Returns a pointer to a new fuse_file_info with the given file handle and open flags.'
+        return ctypes.pointer(fuse_file_info(fh=fh, flags=flags))
+
+    @staticmethod
+    def new_filler(entries=None):
+        '''
+        Returns a readdir filler callback, which appends (name, offset) tuples to entries if
+        it is a list and otherwise only accepts the entries.
+        '''
+        if entries is None:
+            def filler(buf, name, st, offset, *flags):
+                return 0
+        else:
+            def filler(buf, name, st, offset, *flags):
+                entries.append((name, offset))
+                return 0
+        return fuse_fill_dir_t(filler)